@@ -1,11 +1,15 @@
-import requests
+import asyncio
 import re
 import os
+import civitai_client
+import download_ledger
+import metadata_cache
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_FILE = os.path.join(SCRIPT_DIR, "urls.txt")
-DOWNLOAD_LOG = os.path.join(SCRIPT_DIR, "processed_urls.log")
 
 # Output files for different model types
 OUTPUT_FILES = {
@@ -14,6 +18,9 @@ OUTPUT_FILES = {
     "unknown": os.path.join(SCRIPT_DIR, "none.txt")
 }
 
+# Parallel API lookups; civitai_client's shared limiter paces the actual request rate
+CONCURRENCY = 16
+
 def extract_ids(url):
     """Extract model ID and version ID from Civitai URL"""
     model_match = re.search(r'models/(\d+)', url)
@@ -24,125 +31,153 @@ def extract_ids(url):
     
     return model_id, version_id
 
-def load_downloaded_urls():
-    """Load already processed URLs from processed_urls.logs"""
-    if os.path.exists(DOWNLOAD_LOG):
-        with open(DOWNLOAD_LOG, 'r') as f:
-            return set(line.strip() for line in f)
-    return set()
-
-def save_download_url(url):
-    """Save original URL to processed_urls.logs"""
-    with open(DOWNLOAD_LOG, 'a') as f:
-        f.write(f"{url}\n")
-
-def save_url_by_type(url, model_type, original_url):
-    """Save URL to appropriate file based on model type"""
-    output_file = OUTPUT_FILES.get(model_type, OUTPUT_FILES["unknown"])
-    with open(output_file, 'a') as f:
-        f.write(f"{url}\n")
-    save_download_url(original_url)  # Save original URL instead of download URL
-
-def process_version_api(version_id, original_url):
-    """Process model version API endpoint"""
-    api_url = f"https://civitai.com/api/v1/model-versions/{version_id}"
+def save_urls_by_type(entries):
+    """Append resolved download URLs to their type's file and record them in the ledger.
+
+    Each output file is opened once per batch rather than once per URL.
+    """
+    by_file = {}
+    for entry in entries:
+        output_file = OUTPUT_FILES.get(entry['model_type'], OUTPUT_FILES["unknown"])
+        by_file.setdefault(output_file, []).append(entry['download_url'])
+    for output_file, urls in by_file.items():
+        with open(output_file, 'a') as f:
+            f.writelines(f"{url}\n" for url in urls)
+    # Record the original URL's model/version in the ledger instead of the download URL
+    download_ledger.record_queued_many(entries)
+
+async def fetch_all(requests_to_make, concurrency=CONCURRENCY):
+    """Run {key: (func, arg)} metadata lookups concurrently and return {key: data or None}."""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    pbar = tqdm(total=len(requests_to_make), desc="Resolving", unit="req")
+
+    async def fetch(key, func, arg):
+        async with semaphore:
+            try:
+                return key, await loop.run_in_executor(executor, func, arg)
+            except Exception as e:
+                # One bad answer (unreadable JSON, a cache error) must not lose the whole batch
+                tqdm.write(f"Error accessing API for {key}: {e}")
+                return key, None
+            finally:
+                pbar.update(1)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = await asyncio.gather(*(fetch(key, func, arg) for key, (func, arg) in requests_to_make.items()))
+    pbar.close()
+    return dict(results)
+
+def version_entry(url, model_id, version_id, model_type, metadata=None):
+    """Build the queue entry for one resolved model version."""
     download_url = f"https://civitai.com/api/download/models/{version_id}"
-    
-    try:
-        response = requests.get(api_url)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Get model type from API response
-        model_type = data.get("model", {}).get("type", "unknown")
-        save_url_by_type(download_url, model_type, original_url)  # Pass original_url
-        return True
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error accessing Version API: {e}")
-        return False
-
-def process_civitai_url(url, processed_urls):
-    """Process a single Civitai URL and return success status"""
-    if url in processed_urls:
-        print(f"Skipping already processed URL: {url}")
-        return True
-        
-    try:
-        model_id, version_id = extract_ids(url)
-        
-        if version_id:
-            # Direct version ID URL format
-            return process_version_api(version_id, url)
-        elif model_id:
-            # Base model URL format - need to get latest version ID
-            api_url = f"https://civitai.com/api/v1/models/{model_id}"
-            response = requests.get(api_url)
-            response.raise_for_status()
-            data = response.json()
-            
-            if "modelVersions" in data and len(data["modelVersions"]) > 0:
-                # Get the first version (index 0)
-                version_data = data["modelVersions"][0]
-                version_id = version_data.get("id")
-                model_type = data.get("type", "unknown")
-                
-                if version_id:
-                    download_url = f"https://civitai.com/api/download/models/{version_id}"
-                    save_url_by_type(download_url, model_type, url)  # Pass original URL
-                    return True
-                    
-            print(f"No valid version ID found for: {url}")
-            return False
+    return {'download_url': download_url, 'model_type': model_type, 'source_url': url,
+            'model_id': model_id, 'version_id': version_id, 'metadata': metadata}
+
+def version_from_model(model, model_id, version_id):
+    """Shape a /models/{id} version entry like a /model-versions/{id} response."""
+    for version in model.get("modelVersions", []):
+        if str(version.get("id")) == str(version_id):
+            return dict(version, modelId=int(model_id), model={
+                "name": model.get("name"), "type": model.get("type"), "nsfw": model.get("nsfw"),
+            })
+    return None
+
+async def resolve_urls(urls, concurrency=CONCURRENCY):
+    """Resolve Civitai links to download entries, keeping input order.
+
+    Returns one item per URL: an entry dict, "skipped" for links already
+    in the ledger, or None when the link could not be resolved. Links are
+    deduplicated by model ID before anything is requested: one
+    /models/{id} call answers every link to that model, including links
+    with a modelVersionId. /model-versions/{id} is only asked for
+    versions missing from their model's version list.
+    """
+    parsed = {}
+    for url in urls:
+        if url not in parsed:
+            parsed[url] = "skipped" if download_ledger.is_processed(url) else extract_ids(url)
+    pending = {url: ids for url, ids in parsed.items() if ids != "skipped"}
+
+    model_ids = {model_id for model_id, _ in pending.values() if model_id}
+    models = await fetch_all({m: (metadata_cache.get_model, m) for m in model_ids}, concurrency)
+
+    versions_needed = set()
+    for model_id, version_id in pending.values():
+        known = {str(v.get("id")) for v in (models.get(model_id) or {}).get("modelVersions", [])}
+        if version_id and version_id not in known:
+            versions_needed.add(version_id)
+    versions = await fetch_all({v: (metadata_cache.get_model_version, v) for v in versions_needed}, concurrency)
+
+    resolved = {}
+    for url, ids in parsed.items():
+        if ids == "skipped":
+            resolved[url] = ids
+            continue
+        model_id, version_id = ids
+        model = models.get(model_id) or {}
+        if version_id in versions:
+            data = versions[version_id]
+            resolved[url] = version_entry(url, data.get("modelId"), int(version_id),
+                                          data.get("model", {}).get("type", "unknown"), data) if data else None
+        elif version_id:
+            resolved[url] = version_entry(url, int(model_id), int(version_id), model.get("type", "unknown"),
+                                          version_from_model(model, model_id, version_id))
+        elif model_id and model.get("modelVersions") and model["modelVersions"][0].get("id"):
+            # Base model URL format - take the first (latest) version
+            version_id = model["modelVersions"][0]["id"]
+            resolved[url] = version_entry(url, int(model_id), version_id, model.get("type", "unknown"),
+                                          version_from_model(model, model_id, version_id))
         else:
-            print(f"Invalid URL format: {url}")
-            return False
-            
-    except Exception as e:
-        print(f"Error processing URL {url}: {str(e)}")
-        return False
-    
-def process_links_file():
-    """Process URLs from urls.txt file"""
-    if not os.path.exists(INPUT_FILE):
-        print("urls.txt not found!")
-        return
-    
-    processed_urls = load_downloaded_urls()
+            resolved[url] = None
+    return [resolved[url] for url in urls]
+
+def process_links_file(input_file=INPUT_FILE):
+    """Process URLs from urls.txt file
+
+    Returns a dict of counts, or None if the file does not exist.
+    """
+    if not os.path.exists(input_file):
+        print(f"{os.path.basename(input_file)} not found!")
+        return None
     
-    with open(INPUT_FILE, "r") as f:
+    with open(input_file, "r") as f:
         urls = [url.strip() for url in f.readlines() if url.strip()]
     
-    remaining_urls = []
-    processed_count = 0
-    failed_count = 0
-    
-    # Create progress bar
-    pbar = tqdm(urls, desc="Processing URLs", unit="url")
+    results = asyncio.run(resolve_urls(urls))
     
-    for url in pbar:
-        # Update progress bar description with current URL
-        pbar.set_description(f"Processing: {url[:30]}...")
-        
-        if process_civitai_url(url, processed_urls):
-            processed_count += 1
-            pbar.set_postfix(processed=processed_count, failed=failed_count)
-        else:
-            failed_count += 1
+    remaining_urls = []
+    entries = []
+    queued_versions = set()
+    skipped_count = 0
+    for url, result in zip(urls, results):
+        if result == "skipped":
+            skipped_count += 1
+        elif result is None:
+            print(f"Could not resolve: {url}")
             remaining_urls.append(url)
-            pbar.set_postfix(processed=processed_count, failed=failed_count)
+        elif result['version_id'] not in queued_versions:
+            # The same version reached through several links is queued once
+            queued_versions.add(result['version_id'])
+            entries.append(result)
     
-    # Close progress bar
-    pbar.close()
+    save_urls_by_type(entries)
+    metrics.inc("links_total", len(entries), result="queued")
+    metrics.inc("links_total", len(urls) - len(entries) - skipped_count - len(remaining_urls), result="duplicate")
+    metrics.inc("links_total", skipped_count, result="known")
+    metrics.inc("links_total", len(remaining_urls), result="unresolved")
     
     # Update urls.txt with remaining URLs
-    with open(INPUT_FILE, "w") as f:
+    with open(input_file, "w") as f:
         f.writelines(f"{url}\n" for url in remaining_urls)
     
     print(f"\nProcessing complete!")
-    print(f"Successfully processed: {processed_count} URLs")
-    print(f"Failed to process: {failed_count} URLs")
+    print(f"Successfully processed: {len(urls) - len(remaining_urls)} URLs ({len(entries)} queued, {skipped_count} already known)")
+    print(f"Failed to process: {len(remaining_urls)} URLs")
     print(f"Remaining URLs in urls.txt: {len(remaining_urls)}")
+    print(f"API limiter: {civitai_client.limiter_stats()['metadata']}")
+    metrics.report()
+    return {"links": len(urls), "queued": len(entries), "known": skipped_count, "unresolved": len(remaining_urls)}
 
 if __name__ == "__main__":
     process_links_file()
\ No newline at end of file
@@ -1,56 +1,102 @@
+import hashlib
+import json
 import os
+import queue
 import re
+import shutil
+import threading
+import time
 import requests
+import civitai_client
+import download_ledger
+import download_queue
+import file_hashing
+import metadata_cache
+import metrics
+import model_sorter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from typing import Literal
+from urllib.parse import parse_qs, urlparse
 
-# Get script directory and set API key
+# Get script directory; API tokens are loaded by civitai_client from the
+# CIVITAI_API_TOKEN(S) environment variables or api_tokens.txt
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-API_KEY = "85c1a25c0653fb1e81ef01c032f684e7"
+
+# Concurrency limits for the download worker pool
+MAX_WORKERS = 4        # parallel transfers overall
+PER_HOST_LIMIT = None  # parallel transfers against a single host; None allows one per worker
+
+# Interrupted transfers are kept as <key>.part and resumed with HTTP Range
+PART_SUFFIX = ".part"
+DOWNLOAD_RETRIES = 3
+REQUEST_TIMEOUT = (15, 60)  # connect, read seconds
+
+# Transfers are read, hashed and written in large chunks and the progress
+# bar is updated on a timer, so a multi-GB file costs thousands of Python
+# iterations instead of millions
+CHUNK_SIZE = 1024 * 1024   # bytes per read from the connection
+PROGRESS_INTERVAL = 0.25   # seconds between progress bar updates
+
+# A preallocated .part file is full size from the start, so its size says
+# nothing about how much arrived; the sidecar records the byte count
+# instead, synced to disk every SAVE_OFFSET_CHUNKS chunks so a killed
+# process resumes from there
+SAVE_OFFSET_CHUNKS = 64
+
+# Opt-in multi-connection mode for large files on servers that accept ranges
+SEGMENTED_DOWNLOADS = False
+SEGMENT_THRESHOLD = 512 * 1024 * 1024  # only split files at least this big
+SEGMENT_COUNT = 4
+SEGMENT_RETRIES = 3
+
+# Free space is checked before every transfer and the whole file is reserved
+# up front (posix_fallocate where available), so a full disk refuses a job
+# instead of failing halfway; refused jobs stay pending in the queue
+PREALLOCATE = True
+MIN_FREE_BYTES = 1024 * 1024 * 1024  # headroom left on the volume
+
+# Order of queued jobs: "fifo" (queue order), "smallest" first for a fast
+# queue drain, or "largest" first to keep the bandwidth busy
+SCHEDULE_POLICY = "fifo"
+SCHEDULE_POLICIES = ("fifo", "smallest", "largest")
+
+# Name finished files after the model and place them in <type>/<base model>/
+# using the metadata the extractor stored, instead of a later rename pass
+SORT_ON_DOWNLOAD = True
+
+# Before fetching, look the version's SHA256 up in the hash index and reuse a
+# local file with the same content: "hardlink" (falls back to a copy across
+# drives), "copy", or None to always download
+LOCAL_COPY_MODE = "hardlink"
 
 # Define constants for different model types
 MODEL_TYPES = {
     'checkpoints': {
         'file': os.path.join(SCRIPT_DIR, "checkpoints.txt"),
-        'folder': os.path.join(SCRIPT_DIR, "checkpoints"),
-        'log': os.path.join(SCRIPT_DIR, "checkpoints_downloaded.log")
+        'folder': os.path.join(SCRIPT_DIR, "checkpoints")
     },
     'loras': {
         'file': os.path.join(SCRIPT_DIR, "loras.txt"),
-        'folder': os.path.join(SCRIPT_DIR, "loras"),
-        'log': os.path.join(SCRIPT_DIR, "loras_downloaded.log")
+        'folder': os.path.join(SCRIPT_DIR, "loras")
     },
     'others': {
         'file': os.path.join(SCRIPT_DIR, "others.txt"),
-        'folder': os.path.join(SCRIPT_DIR, "others"),
-        'log': os.path.join(SCRIPT_DIR, "others_downloaded.log")
+        'folder': os.path.join(SCRIPT_DIR, "others")
     }
 }
 
-def load_downloaded_urls(log_file):
-    """Load already downloaded URLs from the log file."""
-    if os.path.exists(log_file):
-        with open(log_file, 'r') as file:
-            return set(line.strip() for line in file.readlines())
-    return set()
-
-def save_downloaded_url(log_file, url):
-    """Save successfully downloaded URL to the log file."""
-    with open(log_file, 'a') as file:
-        file.write(f"{url}\n")
+# The failure log and target folders are shared between download workers
+_file_lock = threading.Lock()
+_host_slots = {}
+_host_limit = MAX_WORKERS
+_space_lock = threading.Lock()
 
 def save_failed_url(url, error):
     """Save failed download URLs to failed_downloads.txt with error message."""
-    with open(os.path.join(SCRIPT_DIR, "failed_downloads.txt"), 'a') as file:
+    with _file_lock, open(os.path.join(SCRIPT_DIR, "failed_downloads.txt"), 'a') as file:
         file.write(f"{url} | Error: {error}\n")
 
-def remove_url_from_file(url, file_path):
-    """Remove a URL from the source file."""
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    with open(file_path, 'w') as file:
-        file.writelines(line for line in lines if line.strip() != url)
-
 def get_unique_filename(directory, filename):
     """Generate a unique filename by appending a number if the file already exists."""
     base, ext = os.path.splitext(filename)
@@ -61,73 +107,795 @@ def get_unique_filename(directory, filename):
         counter += 1
     return unique_filename
 
-def download_file(url, target_dir, log_file):
-    """Download a file and log it if successful."""
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+def host_slot(url):
+    """Return the semaphore that bounds concurrent transfers to the URL's host."""
+    host = urlparse(url).netloc
+    with _file_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(_host_limit)
+        return _host_slots[host]
+
+def set_workers(workers):
+    """Size the per-host slots and the download limiter for a pool of workers.
+
+    Every download URL is on civitai.com, so a host cap below the pool
+    size would be the real concurrency. The adaptive limiter starts at
+    the pool size too and still backs off when throttled.
+    """
+    global _host_limit
+    limit = max(1, min(workers, PER_HOST_LIMIT) if PER_HOST_LIMIT else workers)
+    with _file_lock:
+        if limit != _host_limit:
+            _host_limit = limit
+            _host_slots.clear()  # transfers still running release their old semaphore
+    civitai_client.allow_concurrency("download", limit)
+
+class DownloadProgress:
+    """Single aggregate progress bar shared by all download workers."""
+
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.done = 0
+        self.failed = 0
+        self.deferred = 0
+        self.lock = threading.Lock()
+        self.pbar = tqdm(desc="Downloading", total=0, unit='iB', unit_scale=True, unit_divisor=1024)
+        self.set_postfix()
+
+    def add_files(self, count):
+        """Grow the file total when jobs arrive while downloads are running."""
+        with self.lock:
+            self.total_files += count
+            self.set_postfix()
+
+    def add_total(self, size):
+        """Grow the byte total once a transfer knows its size."""
+        with self.lock:
+            self.pbar.total += size
+            self.pbar.refresh()
+
+    def update(self, size):
+        with self.lock:
+            self.pbar.update(size)
+
+    def file_finished(self, success):
+        with self.lock:
+            if success:
+                self.done += 1
+            else:
+                self.failed += 1
+            self.set_postfix()
+
+    def file_deferred(self):
+        """Count a job left in the queue because it did not fit on disk."""
+        with self.lock:
+            self.deferred += 1
+            self.set_postfix()
+
+    def set_postfix(self):
+        finished = self.done + self.failed + self.deferred
+        self.pbar.set_postfix(files=f"{finished}/{self.total_files}", failed=self.failed, deferred=self.deferred)
+
+    def close(self):
+        self.pbar.close()
+
+class ThrottledUpdate:
+    """Progress callback that passes bytes on at most every PROGRESS_INTERVAL seconds.
+
+    Safe to share between the threads of a segmented download; call
+    flush() when the transfer ends so the bar shows every byte.
+    """
+
+    def __init__(self, update):
+        self.update = update
+        self.pending = 0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, size):
+        with self.lock:
+            self.pending += size
+            now = time.monotonic()
+            if now - self.last < PROGRESS_INTERVAL:
+                return
+            pending, self.pending, self.last = self.pending, 0, now
+        self.update(pending)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, 0
+        if pending:
+            self.update(pending)
+
+class IncompleteDownload(IOError):
+    """Raised when a transfer ends before all expected bytes arrived."""
+
+class RemoteFileChanged(IOError):
+    """Raised when a range request no longer matches the file being resumed."""
+
+class InsufficientSpace(IOError):
+    """Raised when a transfer would not fit in the free space of its volume."""
+
+def download_headers():
+    """Return the request headers for downloads; civitai_client adds the API token."""
+    return {"User-Agent": civitai_client.USER_AGENT}
+
+def partial_paths(target_dir, url):
+    """Return the .part file and its metadata sidecar for a download URL."""
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    part_path = os.path.join(target_dir, f"{key}{PART_SUFFIX}")
+    return part_path, f"{part_path}.json"
+
+def load_part_meta(meta_path):
+    """Load the metadata saved alongside a partial download, if any."""
+    try:
+        with open(meta_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def save_part_meta(meta_path, meta):
+    """Save partial download metadata next to the .part file."""
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+
+def discard_partial(part_path, meta_path):
+    """Delete a partial download that can no longer be resumed."""
+    for path in (part_path, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def filename_from_response(response, url):
+    """Get the target filename from Content-Disposition or the URL."""
+    if 'content-disposition' in response.headers:
+        matches = re.findall("filename=(.+)", response.headers['content-disposition'])
+        if matches:
+            return matches[0].strip('"')
+    return url.split('/')[-1]
+
+def resume_matches(response, offset, meta):
+    """Check that a 206 response continues the same remote file at offset."""
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('content-range', ''))
+    if not match or int(match.group(1)) != offset:
+        return False
+    if match.group(2) != '*' and int(match.group(2)) != meta.get('total_size'):
+        return False
+    etag = response.headers.get('etag')
+    return not (etag and meta.get('etag') and etag != meta['etag'])
+
+def open_transfer(url, part_path, meta_path):
+    """Start or resume a transfer and return (response, offset, meta).
+
+    The resume offset is the byte count saved in the sidecar (capped by the
+    file size; sidecars from before it was saved fall back to the size).
+    A resume sends Range/If-Range; if the server ignores the range or the
+    remote file no longer matches the saved ETag/size, the partial file is
+    discarded and the transfer starts from byte zero.
+    """
+    meta = load_part_meta(meta_path)
+    offset = 0
+    if meta and os.path.exists(part_path):
+        size = os.path.getsize(part_path)
+        offset = min(meta.get('offset', size), size)
+    headers = download_headers()
+    if offset:
+        headers['Range'] = f"bytes={offset}-"
+        if meta.get('etag'):
+            headers['If-Range'] = meta['etag']
+
+    response = civitai_client.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+    if offset and response.status_code == 206:
+        if resume_matches(response, offset, meta):
+            return response, offset, meta
+        response.close()
+        discard_partial(part_path, meta_path)
+        return open_transfer(url, part_path, meta_path)
+    if offset and response.status_code == 416:
+        response.close()
+        discard_partial(part_path, meta_path)
+        return open_transfer(url, part_path, meta_path)
+    if not response.ok:
+        # Close first so the connection and the API token's slot are freed
+        response.close()
+        response.raise_for_status()
+
+    meta = {
+        'url': url,
+        'filename': filename_from_response(response, url),
+        'etag': response.headers.get('etag'),
+        'total_size': int(response.headers.get('content-length', 0)),
+        'offset': 0,
     }
-    
+    save_part_meta(meta_path, meta)
+    return response, 0, meta
+
+def fetch_to_part(url, part_path, meta_path, progress=None):
+    """Stream url into part_path, resuming after dropped connections.
+
+    Each chunk is fed into a SHA256 as it is written, so the file never
+    has to be read back; only a resumed prefix is hashed from disk.
+    Returns the completed transfer's metadata with 'sha256' filled in and
+    'received' set to the bytes fetched by this call.
+    """
+    pbar = None
+    reported = False
+    hasher, hashed = None, 0
+    received_now = 0
+    write_seconds = hash_seconds = 0.0
     try:
-        response = requests.get(url, headers=headers, stream=True)
+        for attempt in range(1, DOWNLOAD_RETRIES + 1):
+            try:
+                response, offset, meta = open_transfer(url, part_path, meta_path)
+                if hasher is None or hashed != offset:
+                    hasher = file_hashing.update_from_file(hashlib.sha256(), part_path, offset) \
+                             if offset else hashlib.sha256()
+                    hashed = offset
+                total_size = meta['total_size']
+                if progress is not None and not reported:
+                    progress.add_total(total_size)
+                    progress.update(offset)
+                    reported = True
+                elif progress is None and pbar is None:
+                    pbar = tqdm(desc=meta['filename'], total=total_size, initial=offset,
+                                unit='iB', unit_scale=True, unit_divisor=1024)
+                update = ThrottledUpdate(progress.update if progress is not None else pbar.update)
+
+                with response, open(part_path, 'r+b' if offset else 'wb') as f:
+                    f.seek(offset)
+                    f.truncate()
+                    if total_size:
+                        reserve_space(f, offset, total_size)
+                    try:
+                        for chunks, data in enumerate(response.iter_content(chunk_size=CHUNK_SIZE), 1):
+                            started = time.perf_counter()
+                            size = f.write(data)
+                            written = time.perf_counter()
+                            hasher.update(data)
+                            write_seconds += written - started
+                            hash_seconds += time.perf_counter() - written
+                            hashed += size
+                            received_now += size
+                            update(size)
+                            if chunks % SAVE_OFFSET_CHUNKS == 0:
+                                # Data first, so the saved offset never points past it
+                                f.flush()
+                                os.fsync(f.fileno())
+                                meta['offset'] = hashed
+                                save_part_meta(meta_path, meta)
+                    finally:
+                        # Release the reservation past the last byte received
+                        # and record where a resume starts
+                        f.truncate()
+                        meta['offset'] = hashed
+                        save_part_meta(meta_path, meta)
+                        update.flush()
+
+                received = os.path.getsize(part_path)
+                if total_size and received != total_size:
+                    raise IncompleteDownload(f"got {received} of {total_size} bytes")
+                meta['sha256'] = hasher.hexdigest()
+                meta['received'] = received_now
+                return meta
+            except RETRYABLE_ERRORS as e:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                metrics.inc("download_resumes_total")
+                tqdm.write(f"Transfer of {url} interrupted ({e}), resuming (attempt {attempt + 1}/{DOWNLOAD_RETRIES})")
+    finally:
+        metrics.inc("download_write_seconds_total", write_seconds)
+        metrics.inc("download_hash_seconds_total", hash_seconds)
+        if pbar is not None:
+            pbar.close()
+
+RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    IncompleteDownload,
+)
+
+def preallocate(f, size):
+    """Reserve size bytes for an open file, falling back to a sparse extend."""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass
+    f.truncate(size)
+
+def reserve_space(f, offset, total_size, allocate=None):
+    """Check the rest of a transfer fits on f's volume and preallocate it.
+
+    Raises InsufficientSpace if fewer than MIN_FREE_BYTES would be left.
+    Checking and allocating under one lock keeps parallel workers from
+    each claiming the same free space.
+    """
+    needed = total_size - offset
+    with _space_lock:
+        free = shutil.disk_usage(os.path.dirname(os.path.abspath(f.name))).free
+        if needed + MIN_FREE_BYTES > free:
+            raise InsufficientSpace(f"needs {needed} bytes but only {free} are free")
+        if PREALLOCATE if allocate is None else allocate:
+            preallocate(f, total_size)
+
+def split_ranges(total_size, count):
+    """Split [0, total_size) into count inclusive [start, end] byte ranges."""
+    step = -(-total_size // count)
+    return [[start, min(start + step, total_size) - 1] for start in range(0, total_size, step)]
+
+def probe_ranges(url):
+    """Return (total_size, response headers) if url can be fetched by range, else None."""
+    headers = download_headers()
+    headers['Range'] = 'bytes=0-0'
+    with civitai_client.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
         response.raise_for_status()
-        
-        filename = re.findall("filename=(.+)", response.headers.get('content-disposition', ''))[0].strip('"') \
-                  if 'content-disposition' in response.headers else url.split('/')[-1]
-        
-        filename = get_unique_filename(target_dir, filename)
-        filepath = os.path.join(target_dir, filename)
-        
-        total_size = int(response.headers.get('content-length', 0))
-        with open(filepath, 'wb') as f, tqdm(
-            desc=filename,
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as pbar:
-            for data in response.iter_content(chunk_size=1024):
-                size = f.write(data)
-                pbar.update(size)
-        
-        save_downloaded_url(log_file, url)
-        return True
+        match = re.match(r'bytes 0-0/(\d+)', response.headers.get('content-range', ''))
+        if response.status_code == 206 and match:
+            return int(match.group(1)), response
+        if response.headers.get('accept-ranges') == 'bytes' and 'content-length' in response.headers:
+            return int(response.headers['content-length']), response
+    return None
+
+def fetch_segment(url, part_path, segment, meta, save_meta, update):
+    """Fetch one [start, end] range into part_path with positioned writes.
+
+    segment[0] advances as bytes land, so a retry (or a later run, via the
+    saved metadata) only requests what is still missing.
+    """
+    write_seconds = 0.0
+    with open(part_path, 'r+b') as f:
+        fd = f.fileno()
+        for attempt in range(1, SEGMENT_RETRIES + 1):
+            headers = download_headers()
+            headers['Range'] = f"bytes={segment[0]}-{segment[1]}"
+            if meta.get('etag'):
+                headers['If-Range'] = meta['etag']
+            try:
+                with civitai_client.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise RemoteFileChanged("remote file changed during segmented download")
+                    for data in response.iter_content(chunk_size=CHUNK_SIZE):
+                        started = time.perf_counter()
+                        if hasattr(os, 'pwrite'):
+                            # pwrite may write less than asked; slicing the view copies nothing
+                            view = memoryview(data)
+                            while view:
+                                written = os.pwrite(fd, view, segment[0])
+                                segment[0] += written
+                                view = view[written:]
+                        else:
+                            f.seek(segment[0])
+                            segment[0] += f.write(data)
+                        write_seconds += time.perf_counter() - started
+                        update(len(data))
+                if segment[0] <= segment[1]:
+                    raise IncompleteDownload(f"segment ended {segment[1] - segment[0] + 1} bytes short")
+                return
+            except RETRYABLE_ERRORS:
+                if attempt == SEGMENT_RETRIES:
+                    raise
+            finally:
+                save_meta()
+                metrics.inc("download_write_seconds_total", write_seconds)
+                write_seconds = 0.0
+
+def fetch_segmented(url, part_path, meta_path, progress=None):
+    """Fetch a large file as SEGMENT_COUNT parallel ranges into a preallocated .part file.
+
+    Returns the completed transfer's metadata, or None when the server does
+    not support ranges or the file is below SEGMENT_THRESHOLD, in which case
+    the caller falls back to a single stream.
+    """
+    meta = load_part_meta(meta_path)
+    if meta and 'segments' not in meta:
+        return None  # a single-stream transfer is already under way
+    if not (meta and os.path.exists(part_path)):
+        probed = probe_ranges(url)
+        if probed is None or probed[0] < SEGMENT_THRESHOLD:
+            return None
+        total_size, response = probed
+        meta = {
+            'url': url,
+            'filename': filename_from_response(response, url),
+            'etag': response.headers.get('etag'),
+            'total_size': total_size,
+            'segments': split_ranges(total_size, SEGMENT_COUNT),
+        }
+        with open(part_path, 'wb') as f:
+            # Segments are written at their offsets, so the file is always sized up front
+            reserve_space(f, 0, total_size, allocate=True)
+        save_part_meta(meta_path, meta)
+
+    meta_lock = threading.Lock()
+    def save_meta():
+        with meta_lock:
+            meta['segments'] = [seg for seg in meta['segments'] if seg[0] <= seg[1]]
+            save_part_meta(meta_path, meta)
+
+    remaining = sum(end - start + 1 for start, end in meta['segments'])
+    done = meta['total_size'] - remaining
+    if progress is not None:
+        progress.add_total(meta['total_size'])
+        progress.update(done)
+        update, close = ThrottledUpdate(progress.update), None
+    else:
+        pbar = tqdm(desc=meta['filename'], total=meta['total_size'], initial=done,
+                    unit='iB', unit_scale=True, unit_divisor=1024)
+        update, close = ThrottledUpdate(pbar.update), pbar.close
+
+    try:
+        with ThreadPoolExecutor(max_workers=SEGMENT_COUNT) as executor:
+            futures = [executor.submit(fetch_segment, url, part_path, segment, meta, save_meta, update)
+                       for segment in list(meta['segments'])]
+            for future in as_completed(futures):
+                future.result()
+    except RemoteFileChanged:
+        discard_partial(part_path, meta_path)
+        raise
+    finally:
+        update.flush()
+        if close is not None:
+            close()
+    # Segments arrive out of order, so the hash needs one read of the finished file
+    started = time.perf_counter()
+    meta['sha256'] = file_hashing.hash_file(part_path)
+    metrics.inc("download_hash_seconds_total", time.perf_counter() - started)
+    meta['received'] = meta['total_size'] - done
+    return meta
+
+def version_metadata(url):
+    """Return the model-versions data for a download URL, or {} if unavailable.
+
+    Prefers the metadata the extractor stored in the ledger, then the API cache.
+    """
+    _, version_id = download_ledger.parse_ids(url)
+    if version_id is None:
+        return {}
+    stored = download_ledger.get_metadata(version_id)
+    if stored:
+        return stored
+    try:
+        return metadata_cache.get_model_version(version_id) or {}
+    except requests.exceptions.RequestException:
+        return {}
+
+def expected_sha256(data, url):
+    """Return the SHA256 the version metadata lists for the file url fetches, if known.
+
+    Served file names need not match files[].name, so the file is picked
+    by remote_file(); when that is ambiguous there is nothing to check.
+    """
+    return (remote_file(data, url) or {}).get('hashes', {}).get('SHA256')
+
+def remote_file(data, url):
+    """Return the files[] entry a download URL will fetch, or None if that is ambiguous.
+
+    Without type/format query parameters Civitai serves the primary file.
+    """
+    query = parse_qs(urlparse(url).query)
+    wanted_type = query.get('type', [None])[0]
+    wanted_format = query.get('format', [None])[0]
+    files = data.get('files', [])
+    if not (wanted_type or wanted_format):
+        return next((file for file in files if file.get('primary')), None)
+    matches = [file for file in files
+               if (not wanted_type or file.get('type') == wanted_type)
+               and (not wanted_format or (file.get('metadata') or {}).get('format') == wanted_format)]
+    return matches[0] if len(matches) == 1 else None
+
+def link_or_copy(source, target):
+    """Give target source's content, by hard link when LOCAL_COPY_MODE allows it.
+
+    The link or copy is made under a temporary name and moved over target,
+    so target (typically an empty placeholder reserving the name) only
+    ever holds the complete file.
+    """
+    temp_path = f"{target}{PART_SUFFIX}"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        linked = False
+        if LOCAL_COPY_MODE == "hardlink":
+            try:
+                os.link(source, temp_path)
+                linked = True
+            except OSError:
+                pass  # other drive or no hard link support
+        if not linked:
+            shutil.copy2(source, temp_path)
+        os.replace(temp_path, target)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def reserve_filename(folder, filename):
+    """Pick a free name in folder and create it empty, so no other worker takes it; returns the path."""
+    with _file_lock:
+        filepath = os.path.join(folder, get_unique_filename(folder, filename))
+        os.close(os.open(filepath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    return filepath
+
+def destination(target_dir, data, filename):
+    """Return (folder, filename) for a finished download.
+
+    With SORT_ON_DOWNLOAD and known metadata the file goes to
+    target_dir/<base model>/<model name><ext>; otherwise it keeps the
+    server's filename in target_dir.
+    """
+    model_name = model_sorter.clean_filename(data.get('model', {}).get('name') or '')
+    if not (SORT_ON_DOWNLOAD and model_name):
+        return target_dir, filename
+    folder = os.path.join(target_dir, model_sorter.base_model_folder(data.get('baseModel')))
+    return folder, f"{model_name}{os.path.splitext(filename)[1]}"
+
+def record_finished(url, model_type, data, filepath, sha256):
+    """Record a file now in the library in the hash index and the download ledger."""
+    filepath = os.path.abspath(filepath)
+    file_hashing.record(filepath, os.stat(filepath), sha256)
+    api_type = data.get('model', {}).get('type') or download_ledger.CATEGORY_TYPES.get(model_type)
+    download_ledger.record_download(url, api_type, filepath, os.path.getsize(filepath), sha256, data.get('modelId'))
+
+def reuse_local_copy(url, target_dir, model_type, data):
+    """Place a local file with the version's SHA256 instead of downloading it.
+
+    Returns the file's path, or None when no local file has that content.
+    A matching file already in the destination folder is recorded as is.
+    """
+    remote = remote_file(data, url)
+    sha256 = (remote or {}).get('hashes', {}).get('SHA256')
+    if not (LOCAL_COPY_MODE and sha256):
+        return None
+    sha256 = sha256.lower()
+    sources = file_hashing.paths_for_hash(sha256)
+    if not sources:
+        return None
+
+    folder, filename = destination(target_dir, data, remote.get('name') or url.split('/')[-1])
+    in_place = [path for path in sources
+                if model_sorter.already_in_place(path, folder, filename)]
+    if in_place:
+        filepath = in_place[0]
+    else:
+        os.makedirs(folder, exist_ok=True)
+        # Only the name is reserved under the lock; a copy can take minutes
+        filepath = reserve_filename(folder, filename)
+        try:
+            link_or_copy(sources[0], filepath)
+        except OSError:
+            os.remove(filepath)
+            raise
+    discard_partial(*partial_paths(target_dir, url))
+    record_finished(url, model_type, data, filepath, sha256)
+    tqdm.write(f"Reused local copy {sources[0]} for {url}")
+    return filepath
+
+def record_outcome(url, outcome, started, received=0, **fields):
+    """Record a finished download attempt in the metrics and the event log.
+
+    outcome is "done", "reused", "failed" or "deferred"; started is the
+    perf_counter() value when the transfer began.
+    """
+    seconds = time.perf_counter() - started
+    metrics.inc("downloads_total", outcome=outcome)
+    if outcome == "done":
+        metrics.inc("download_bytes_total", received)
+        metrics.observe("download_seconds", seconds)
+        if received and seconds > 0:
+            metrics.observe("download_throughput_bytes_per_second", received / seconds,
+                            buckets=metrics.BYTES_PER_SECOND_BUCKETS)
+    metrics.event("download", url=url, outcome=outcome, seconds=round(seconds, 3), bytes=received, **fields)
+
+def queue_gauges():
+    """Publish the download queue's job counts per state."""
+    counts = download_queue.counts()
+    for state in (download_queue.PENDING, download_queue.IN_PROGRESS, download_queue.DONE, download_queue.FAILED):
+        metrics.set_gauge("download_queue_jobs", counts.get(state, 0), state=state)
+
+def download_file(url, target_dir, model_type, progress=None):
+    """Download a file and record it in the ledger if successful.
+
+    Returns the downloaded file's path, or None if the download failed.
+
+    Bytes go to a .part file that a retry or a later run resumes with a
+    Range request; the file is renamed into place only once complete.
+    With SEGMENTED_DOWNLOADS, large files are fetched over several
+    connections at once. The SHA256 computed during the transfer is checked
+    against the model-versions API and recorded in the hash index and the
+    download ledger, and the file is named and routed from the same
+    metadata (see destination()).
+    When a shared DownloadProgress is given, bytes are reported to it instead
+    of drawing a per-file progress bar.
+    If a local file already has the version's SHA256, it is linked or
+    copied into place instead (see reuse_local_copy()).
+    InsufficientSpace is raised rather than handled: the job did not fail
+    and should stay queued until there is room.
+    """
+    part_path, meta_path = partial_paths(target_dir, url)
+    started = time.perf_counter()
+    
+    try:
+        data = version_metadata(url)
+        filepath = reuse_local_copy(url, target_dir, model_type, data)
+        if filepath:
+            record_outcome(url, "reused", started, path=filepath)
+            return filepath
+
+        with host_slot(url):
+            # Time the transfer itself, not the wait for a host slot
+            started = time.perf_counter()
+            meta = None
+            if SEGMENTED_DOWNLOADS:
+                meta = fetch_segmented(url, part_path, meta_path, progress)
+            if meta is None:
+                meta = fetch_to_part(url, part_path, meta_path, progress)
+
+        expected = expected_sha256(data, url)
+        if expected and expected.lower() != meta['sha256']:
+            discard_partial(part_path, meta_path)
+            raise IOError(f"SHA256 mismatch: expected {expected.lower()}, got {meta['sha256']}")
+
+        folder, filename = destination(target_dir, data, meta['filename'])
+        os.makedirs(folder, exist_ok=True)
+        with _file_lock:
+            filename = get_unique_filename(folder, filename)
+            filepath = os.path.join(folder, filename)
+            os.replace(part_path, filepath)
+        os.remove(meta_path)
+        record_finished(url, model_type, data, filepath, meta['sha256'])
+        record_outcome(url, "done", started, meta['received'], path=filepath, size=meta['total_size'])
+        return filepath
+    except InsufficientSpace as e:
+        tqdm.write(f"Deferred {url}: {e}")
+        record_outcome(url, "deferred", started, error=str(e))
+        raise
     except Exception as e:
         error_msg = str(e)
-        print(f"Error downloading {url}: {error_msg}")
+        tqdm.write(f"Error downloading {url}: {error_msg}")
         save_failed_url(url, error_msg)
-        return False
+        record_outcome(url, "failed", started, error=error_msg)
+        return None
+
+def expected_size(url):
+    """Return the file size in bytes the version metadata lists for a download URL, or None."""
+    size_kb = (remote_file(version_metadata(url), url) or {}).get('sizeKB')
+    return int(size_kb * 1024) if size_kb else None
 
-def process_downloads(model_type: Literal['checkpoints', 'loras', 'others']):
-    """Process downloads for specified model type."""
+def schedule(jobs, policy=SCHEDULE_POLICY):
+    """Order (model_type, url) jobs by policy; returns (jobs to run, jobs deferred).
+
+    Sizes come from the version metadata. Jobs bigger than their volume's
+    free space are deferred up front, and jobs of unknown size run last.
+    The "fifo" policy keeps queue order and leaves the space check to the
+    transfer itself.
+    """
+    if policy not in SCHEDULE_POLICIES:
+        raise ValueError(f"policy must be one of {SCHEDULE_POLICIES}")
+    if policy == "fifo" or not jobs:
+        return list(jobs), []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sizes = dict(zip(jobs, executor.map(lambda job: expected_size(job[1]), jobs)))
+
+    free = {}
+    known, unknown, deferred = [], [], []
+    for job in jobs:
+        folder = MODEL_TYPES[job[0]]['folder']
+        if folder not in free:
+            free[folder] = shutil.disk_usage(folder).free
+        size = sizes[job]
+        if size is None:
+            unknown.append(job)
+        elif size + MIN_FREE_BYTES > free[folder]:
+            deferred.append(job)
+        else:
+            known.append(job)
+    known.sort(key=sizes.get, reverse=policy == "largest")
+    return known + unknown, deferred
+
+def run_downloads(jobs, workers=MAX_WORKERS, policy=SCHEDULE_POLICY):
+    """Download (model_type, url) jobs through a bounded worker pool.
+
+    Jobs start in the order chosen by schedule(). Each job is marked done
+    or failed in the download queue once its transfer finishes; failures
+    are also recorded in failed_downloads.txt. Jobs that do not fit on
+    disk stay pending for a later run.
+    On Ctrl+C no further jobs start and KeyboardInterrupt is re-raised
+    without waiting for running transfers: jobs that never started are
+    still pending, and interrupted ones go back to pending on the next run
+    (see download_queue.recover()) and resume from their .part files.
+    Returns (downloaded, failed) counts.
+    """
+    queue_gauges()
+    jobs, deferred = schedule(jobs, policy)
+    if deferred:
+        print(f"Deferred {len(deferred)} downloads that do not fit in the free space")
+    if not jobs:
+        return 0, 0
+    set_workers(workers)
+    progress = DownloadProgress(len(jobs))
+    pending = queue.Queue()
+    for job in jobs:
+        pending.put(job)
+    stop = threading.Event()
+    errors = []
+
+    def worker():
+        while not stop.is_set():
+            try:
+                model_type, url = pending.get_nowait()
+            except queue.Empty:
+                return
+            config = MODEL_TYPES[model_type]
+            try:
+                download_queue.mark(model_type, url, download_queue.IN_PROGRESS)
+                try:
+                    success = download_file(url, config['folder'], model_type, progress) is not None
+                except InsufficientSpace:
+                    download_queue.mark(model_type, url, download_queue.PENDING)
+                    progress.file_deferred()
+                    continue
+                download_queue.mark(model_type, url, download_queue.DONE if success else download_queue.FAILED)
+                progress.file_finished(success)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    # Daemon threads, so an interrupted run exits without waiting for a transfer to finish
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(workers, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        progress.close()
+    if errors:
+        raise errors[0]
+    print(f"\nDownloaded {progress.done} files, {progress.failed} failed, {progress.deferred} deferred")
+    print(f"Download limiter: {civitai_client.limiter_stats()['download']}")
+    for name, stats in civitai_client.token_stats().items():
+        print(f"API token {name}: {stats['download']}" + (" (rejected)" if stats['disabled'] else ""))
+    queue_gauges()
+    metrics.report()
+    return progress.done, progress.failed
+
+def collect_jobs(model_type: Literal['checkpoints', 'loras', 'others']):
+    """Import a queue file and return the (model_type, url) jobs still to download."""
     config = MODEL_TYPES[model_type]
     
     os.makedirs(config['folder'], exist_ok=True)
     
-    if not os.path.exists(config['file']):
-        print(f"Error: {config['file']} not found")
-        return
-        
-    downloaded = load_downloaded_urls(config['log'])
-    
-    with open(config['file'], 'r') as f:
-        urls = [line.strip() for line in f if line.strip()]
+    download_queue.recover(model_type)
+    imported = download_queue.import_file(model_type, config['file'])
+    urls = download_queue.pending_urls(model_type)
     
-    total_urls = len(urls)
-    print(f"\nFound {total_urls} URLs in {os.path.basename(config['file'])}")
+    print(f"\nImported {imported} URLs from {os.path.basename(config['file'])}, {len(urls)} pending")
     
-    for i, url in enumerate(urls, 1):
-        if url in downloaded:
-            print(f"\nSkipping {url} (already downloaded)")
-            remove_url_from_file(url, config['file'])
+    jobs = []
+    for url in urls:
+        if download_ledger.is_downloaded(url):
+            print(f"Skipping {url} (already downloaded)")
+            download_queue.mark(model_type, url, download_queue.DONE)
             continue
-            
-        print(f"\nProcessing [{i}/{total_urls}]: {url}")
-        success = download_file(url, config['folder'], config['log'])
-        
-        # Remove URL from source file regardless of success
-        # If failed, it's already saved to failed_downloads.txt
-        remove_url_from_file(url, config['file'])
+        jobs.append((model_type, url))
+    return jobs
+
+def process_downloads(model_type: Literal['checkpoints', 'loras', 'others'], workers=MAX_WORKERS,
+                      policy=SCHEDULE_POLICY):
+    """Process downloads for specified model type; returns (downloaded, failed)."""
+    return run_downloads(collect_jobs(model_type), workers, policy)
+
+def process_all_downloads(workers=MAX_WORKERS, policy=SCHEDULE_POLICY):
+    """Drain every model type's queue through one shared worker pool; returns (downloaded, failed)."""
+    jobs = []
+    for model_type in MODEL_TYPES:
+        jobs.extend(collect_jobs(model_type))
+    return run_downloads(jobs, workers, policy)
 
 if __name__ == "__main__":
     while True:
@@ -135,15 +903,18 @@ if __name__ == "__main__":
         print("1. Checkpoints")
         print("2. Loras")
         print("3. Others")
-        print("4. Exit")
+        print("4. All")
+        print("5. Exit")
         
-        choice = input("\nEnter your choice (1-4): ")
+        choice = input("\nEnter your choice (1-5): ")
         
-        if choice == '4':
+        if choice == '5':
             break
         
         type_map = {'1': 'checkpoints', '2': 'loras', '3': 'others'}
         if choice in type_map:
             process_downloads(type_map[choice])
+        elif choice == '4':
+            process_all_downloads()
         else:
             print("Invalid choice. Please try again.")
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Measure file hashing throughput in MB/s.
+
+Hashes either an existing model folder or a set of synthetic files with
+different worker counts and read sizes, bypassing the hash index so every
+byte is read. Synthetic files are usually still in the page cache, so they
+measure CPU throughput; point --folder at a real library (after dropping
+caches) to measure the disk.
+
+    python bench/hash_benchmark.py --files 8 --size-mb 256
+    python bench/hash_benchmark.py --folder D:/models/loras --workers 1 2 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_hashing
+
+def make_synthetic_files(folder, count, size_mb):
+    """Write count random files of size_mb each and return their paths."""
+    block = os.urandom(1024 * 1024)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"synthetic_{i}.safetensors")
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+def run(paths, workers, read_size):
+    """Hash all paths and return throughput in MB/s."""
+    file_hashing.READ_SIZE = read_size
+    total = sum(os.path.getsize(path) for path in paths)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(file_hashing.hash_file, paths))
+    elapsed = time.perf_counter() - start
+    return total / (1024 * 1024) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", help="hash the model files in this folder instead of synthetic ones")
+    parser.add_argument("--files", type=int, default=8, help="number of synthetic files")
+    parser.add_argument("--size-mb", type=int, default=128, help="size of each synthetic file")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--read-sizes", type=int, nargs="+", default=[4096, 8 * 1024 * 1024])
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.folder:
+        paths = file_hashing.find_model_files(args.folder)
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="hash_bench_")
+        paths = make_synthetic_files(temp_dir, args.files, args.size_mb)
+    if not paths:
+        print("No model files to hash.")
+        return
+
+    total_mb = sum(os.path.getsize(path) for path in paths) / (1024 * 1024)
+    print(f"Hashing {len(paths)} files, {total_mb:.0f} MB per run")
+    print(f"{'read size':>12} {'workers':>8} {'MB/s':>10}")
+    try:
+        for read_size in args.read_sizes:
+            for workers in args.workers:
+                print(f"{read_size:>12} {workers:>8} {run(paths, workers, read_size):>10.1f}")
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
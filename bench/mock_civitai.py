@@ -0,0 +1,343 @@
+"""Local stand-in for the Civitai API and download server.
+
+Serves a synthetic catalog so the tools can be measured without touching
+civitai.com:
+
+    GET  /api/v1/models?ids=1&ids=2...           (ETag, If-None-Match)
+    GET  /api/v1/models/{id}                     (ETag, If-None-Match)
+    GET  /api/v1/model-versions/{id}
+    GET  /api/v1/model-versions/by-hash/{sha256}
+    POST /api/v1/model-versions/by-hash          (JSON list of hashes)
+    GET  /api/download/models/{version id}       (Content-Disposition, ETag, Range)
+
+Model M has versions_per_model versions with IDs M * 100 + k, and
+add_version() publishes another one. Every file is file_size bytes of
+deterministic content (see file_content()), so a benchmark can write the
+same bytes to disk and have them identified by hash. Latency,
+per-connection bandwidth, a 500 error rate and a 429 rate are
+configurable and can be changed while the server runs.
+
+    python bench/mock_civitai.py --port 8000 --latency 0.05 --bandwidth-mb 20
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BASE_MODELS = ["SD 1.5", "SDXL 1.0", "Pony", "Flux.1 D", "Illustrious"]
+MODEL_TYPES = ["LORA", "Checkpoint"]
+BLOCK_SIZE = 64 * 1024   # content is one random block per version, repeated
+SEND_SIZE = 64 * 1024    # bytes written per socket send
+
+class MockCivitai:
+    """Catalog, fault settings and HTTP server for one mock instance."""
+
+    def __init__(self, models=100, versions_per_model=2, file_size=1024 * 1024, latency=0.0,
+                 bandwidth=0, error_rate=0.0, throttle_rate=0.0, retry_after=0.1, seed=0):
+        self.models = models
+        self.versions_per_model = versions_per_model
+        self.file_size = file_size
+        self.latency = latency              # seconds before every response
+        self.bandwidth = bandwidth          # bytes/s per download connection, 0 = unlimited
+        self.error_rate = error_rate        # fraction of requests answered 500
+        self.throttle_rate = throttle_rate  # fraction of requests answered 429
+        self.retry_after = retry_after      # Retry-After sent with 429s, in seconds
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.by_hash = None
+        self.added = {}                     # model ID -> versions published after start
+        self.requests = {}
+        self.cpu_seconds = 0.0              # CPU time spent sending files, to subtract from client figures
+        self.server = None
+        self.url = ""
+
+    # Catalog
+
+    def set_file_size(self, file_size):
+        """Change the size of every file; cached hashes are dropped."""
+        with self.lock:
+            self.file_size = file_size
+            self.hashes = {}
+            self.by_hash = None
+
+    def version_count(self, model_id):
+        return self.versions_per_model + self.added.get(model_id, 0)
+
+    def version_ids(self, model_id):
+        return [model_id * 100 + k for k in range(self.version_count(model_id))]
+
+    def add_version(self, model_id):
+        """Publish a new version of a model; returns its ID."""
+        with self.lock:
+            self.added[model_id] = self.added.get(model_id, 0) + 1
+            self.by_hash = None
+        return self.version_ids(model_id)[-1]
+
+    def etag(self, model_ids):
+        """ETag for the answer about model_ids; changes when one gains a version."""
+        digest = hashlib.sha1(",".join(f"{m}:{self.version_count(m)}" for m in model_ids).encode())
+        return f'"{digest.hexdigest()[:16]}"'
+
+    def all_version_ids(self):
+        return [version_id for model_id in range(1, self.models + 1) for version_id in self.version_ids(model_id)]
+
+    def has_version(self, version_id):
+        model_id, k = divmod(version_id, 100)
+        return 1 <= model_id <= self.models and k < self.version_count(model_id)
+
+    def block(self, version_id):
+        return random.Random(version_id).randbytes(min(BLOCK_SIZE, self.file_size))
+
+    def file_content(self, version_id, start=0, end=None):
+        """Yield the bytes of a version's file from start to end (inclusive)."""
+        end = self.file_size - 1 if end is None else end
+        block = self.block(version_id)
+        position = start
+        while position <= end:
+            offset = position % len(block)
+            chunk = block[offset:offset + min(len(block) - offset, end - position + 1, SEND_SIZE)]
+            yield chunk
+            position += len(chunk)
+
+    def sha256(self, version_id):
+        with self.lock:
+            if version_id not in self.hashes:
+                digest = hashlib.sha256()
+                for chunk in self.file_content(version_id):
+                    digest.update(chunk)
+                self.hashes[version_id] = digest.hexdigest()
+            return self.hashes[version_id]
+
+    def version(self, version_id, with_model=True):
+        model_id = version_id // 100
+        data = {
+            "id": version_id,
+            "modelId": model_id,
+            "name": f"v{version_id % 100 + 1}",
+            "baseModel": BASE_MODELS[model_id % len(BASE_MODELS)],
+            "downloadUrl": f"{self.url}/api/download/models/{version_id}",
+            "files": [{
+                "name": f"model_{version_id}.safetensors",
+                "primary": True,
+                "type": "Model",
+                "sizeKB": self.file_size / 1024,
+                "metadata": {"format": "SafeTensor"},
+                "hashes": {"SHA256": self.sha256(version_id).upper()},
+            }],
+        }
+        if with_model:
+            data["model"] = {"name": f"Model {model_id}", "type": MODEL_TYPES[model_id % len(MODEL_TYPES)],
+                             "nsfw": False}
+        return data
+
+    def model(self, model_id):
+        # Newest version first, like the real API
+        return {
+            "id": model_id,
+            "name": f"Model {model_id}",
+            "type": MODEL_TYPES[model_id % len(MODEL_TYPES)],
+            "nsfw": False,
+            "modelVersions": [self.version(v, with_model=False) for v in reversed(self.version_ids(model_id))],
+        }
+
+    def version_for_hash(self, sha256):
+        with self.lock:
+            ready = self.by_hash is not None
+        if not ready:
+            by_hash = {self.sha256(version_id): version_id for version_id in self.all_version_ids()}
+            with self.lock:
+                self.by_hash = by_hash
+        return self.by_hash.get(sha256.lower())
+
+    # Server
+
+    def start(self, host="127.0.0.1", port=0):
+        """Start serving in a background thread; returns the base URL."""
+        class Handler(MockHandler):
+            mock = self
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def fault(self):
+        """Return 429, 500 or None for the next request, per the configured rates."""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, data, etag=None):
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        if status == 429:
+            self.send_header("Retry-After", str(self.mock.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def begin(self, kind):
+        """Apply latency and fault injection; returns False if a fault was sent."""
+        self.mock.count(kind)
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        status = self.mock.fault()
+        if status:
+            self.mock.count(str(status))
+            self.send_json(status, {"error": "injected"})
+            return False
+        return True
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/api/v1/models":
+            if self.begin("models-list"):
+                model_ids = [int(v) for v in parse_qs(query).get("ids", []) if 1 <= int(v) <= self.mock.models]
+                self.send_json(200, {"items": [self.mock.model(m) for m in model_ids],
+                                     "metadata": {"totalItems": len(model_ids)}},
+                               etag=self.mock.etag(model_ids))
+            return
+        match = re.fullmatch(r"/api/v1/models/(\d+)", path)
+        if match:
+            if self.begin("models"):
+                model_id = int(match.group(1))
+                if 1 <= model_id <= self.mock.models:
+                    self.send_json(200, self.mock.model(model_id), etag=self.mock.etag([model_id]))
+                else:
+                    self.send_json(404, {"error": "not found"})
+            return
+        match = re.fullmatch(r"/api/v1/model-versions/by-hash/([0-9a-fA-F]+)", path)
+        if match:
+            if self.begin("by-hash"):
+                version_id = self.mock.version_for_hash(match.group(1))
+                if version_id:
+                    self.send_json(200, self.mock.version(version_id))
+                else:
+                    self.send_json(404, {"error": "not found"})
+            return
+        match = re.fullmatch(r"/api/v1/model-versions/(\d+)", path)
+        if match:
+            if self.begin("model-versions"):
+                version_id = int(match.group(1))
+                if self.mock.has_version(version_id):
+                    self.send_json(200, self.mock.version(version_id))
+                else:
+                    self.send_json(404, {"error": "not found"})
+            return
+        match = re.fullmatch(r"/api/download/models/(\d+)", path)
+        if match:
+            if self.begin("download"):
+                self.send_file(int(match.group(1)))
+            return
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?", 1)[0] != "/api/v1/model-versions/by-hash":
+            self.send_json(404, {"error": "not found"})
+            return
+        if self.begin("by-hash-batch"):
+            version_ids = [self.mock.version_for_hash(sha256) for sha256 in json.loads(body)]
+            self.send_json(200, [self.mock.version(v) for v in version_ids if v])
+
+    def send_file(self, version_id):
+        mock = self.mock
+        if not mock.has_version(version_id):
+            self.send_json(404, {"error": "not found"})
+            return
+        size = mock.file_size
+        start, end, status = 0, size - 1, 200
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and int(match.group(1)) < size:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            status = 206
+        elif match:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{version_id}-{size}"')
+        self.send_header("Content-Disposition", f'attachment; filename="model_{version_id}.safetensors"')
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        sent = 0
+        try:
+            for chunk in mock.file_content(version_id, start, end):
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if mock.bandwidth:
+                    ahead = sent / mock.bandwidth - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with mock.lock:
+                mock.cpu_seconds += time.thread_time() - cpu_started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--models", type=int, default=100)
+    parser.add_argument("--versions", type=int, default=2, help="versions per model")
+    parser.add_argument("--file-size-mb", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--bandwidth-mb", type=float, default=0.0, help="MB/s per download connection (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    args = parser.parse_args()
+    mock = MockCivitai(args.models, args.versions, int(args.file_size_mb * 1024 * 1024), args.latency,
+                       int(args.bandwidth_mb * 1024 * 1024), args.error_rate, args.throttle_rate)
+    url = mock.start(port=args.port)
+    print(f"Mock Civitai serving at {url} (Ctrl+C to stop)")
+    print(f"Point the tools at it with metadata_cache.API_BASE = \"{url}/api/v1\"")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
+
+if __name__ == "__main__":
+    main()
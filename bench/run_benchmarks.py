@@ -0,0 +1,278 @@
+"""Benchmark the extractor, downloader, hashing and sort pass against a local mock.
+
+Every benchmark runs in a temporary folder with its own hash index,
+ledger, queue and API cache, and talks to bench/mock_civitai.py instead
+of civitai.com, so results are repeatable and nothing in the real
+library is touched. Results are rates, higher is better, except CPU cost:
+
+    extractor       links resolved per second (/models and /model-versions calls)
+    download cN     MB/s downloading files with N workers
+    download CPU    CPU seconds per GB downloaded with one worker (lower is better),
+                    not counting the mock's own time spent sending
+    hashing         MB/s through file_hashing on synthetic files
+    sort cold       files per second for a sort pass that hashes and looks up everything
+    sort warm       files per second for a second pass (hash index and API cache warm)
+    watch cold      models per second for a first watch check (full answers)
+    watch warm      models per second for a repeat check (304 Not Modified)
+
+Results are compared with bench/baseline.json and anything more than
+--tolerance slower is flagged, with exit code 1. The client's adaptive
+rate limits stay at their defaults, so the numbers include the pacing
+real runs get. The mock runs in the same process, so on a machine with
+few cores its own CPU time is part of the download numbers.
+
+    python bench/run_benchmarks.py
+    python bench/run_benchmarks.py --quick --latency 0.05 --throttle-rate 0.05
+    python bench/run_benchmarks.py --save-baseline
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import civitai_client
+import download_ledger
+import download_queue
+import file_hashing
+import metadata_cache
+import model_sorter
+import watch
+
+from hash_benchmark import make_synthetic_files, run as run_hashing
+from mock_civitai import MockCivitai
+
+extractor = importlib.import_module("1_Civitai_link_extractor")
+downloader = importlib.import_module("2_civitai_downloader")
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+MB = 1024 * 1024
+GB = 1024 * MB
+LOWER_IS_BETTER = ("download CPU s/GB",)
+
+def isolate(work_dir, mock):
+    """Point every store at work_dir and every API call at the mock, with fresh state."""
+    os.makedirs(work_dir, exist_ok=True)
+    file_hashing.INDEX_FILE = os.path.join(work_dir, "hash_index.sqlite")
+    download_ledger.LEDGER_FILE = os.path.join(work_dir, "download_ledger.sqlite")
+    download_ledger.PROCESSED_LOG = os.path.join(work_dir, "processed_urls.log")
+    download_ledger.DOWNLOAD_LOGS = {}
+    download_queue.QUEUE_FILE = os.path.join(work_dir, "download_queue.sqlite")
+    metadata_cache.CACHE_FILE = os.path.join(work_dir, "civitai_cache.sqlite")
+    metadata_cache.API_BASE = f"{mock.url}/api/v1"
+    metadata_cache.OFFLINE = False
+    metadata_cache._batch_by_hash = True
+    for module in (file_hashing, download_ledger, download_queue, metadata_cache):
+        module._local = threading.local()
+    downloader.SCRIPT_DIR = work_dir
+    for model_type, config in downloader.MODEL_TYPES.items():
+        config["folder"] = os.path.join(work_dir, model_type)
+        os.makedirs(config["folder"], exist_ok=True)
+    reset_limiters()
+    civitai_client.configure(tokens=[])
+
+def reset_limiters():
+    """Start from the configured limits, not where the last benchmark left them."""
+    civitai_client.LIMITERS = {name: civitai_client.AdaptiveLimiter(**limits)
+                               for name, limits in civitai_client.ENDPOINT_LIMITS.items()}
+
+def bench_extractor(mock, work_dir, models):
+    """Resolve a mix of model and version links; returns links per second."""
+    isolate(work_dir, mock)
+    urls = []
+    for model_id in range(1, models + 1):
+        urls.append(f"https://civitai.com/models/{model_id}")
+        urls.append(f"https://civitai.com/models/{model_id}?modelVersionId={model_id * 100 + 1}")
+    start = time.perf_counter()
+    results = asyncio.run(extractor.resolve_urls(urls))
+    elapsed = time.perf_counter() - start
+    unresolved = sum(1 for result in results if result is None)
+    if unresolved:
+        print(f"  extractor: {unresolved} links unresolved")
+    return len(urls) / elapsed
+
+def bench_downloads(mock, work_dir, files, file_size, workers):
+    """Download files through run_downloads with the given workers.
+
+    Returns (MB/s, client CPU seconds per GB).
+    """
+    isolate(work_dir, mock)
+    mock.set_file_size(file_size)
+    jobs = [("loras", f"{mock.url}/api/download/models/{(i + 1) * 100}") for i in range(files)]
+    download_queue.add_urls("loras", [url for _, url in jobs])
+    mock_cpu = mock.cpu_seconds
+    cpu = time.process_time()
+    start = time.perf_counter()
+    done, failed = downloader.run_downloads(jobs, workers)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu - (mock.cpu_seconds - mock_cpu)
+    if failed:
+        print(f"  download: {failed} of {files} failed")
+    downloaded = done * file_size
+    return downloaded / MB / elapsed, cpu / (downloaded / GB) if downloaded else 0.0
+
+def bench_hashing(work_dir, files, size_mb):
+    """Hash synthetic files with the default workers and read size; returns MB/s."""
+    os.makedirs(work_dir, exist_ok=True)
+    paths = make_synthetic_files(work_dir, files, size_mb)
+    return run_hashing(paths, file_hashing.HASH_WORKERS, file_hashing.READ_SIZE)
+
+def bench_sort(mock, work_dir, files, file_size):
+    """Sort a tree of files the mock can identify; returns (cold, warm) files per second."""
+    isolate(work_dir, mock)
+    mock.set_file_size(file_size)
+    incoming = os.path.join(work_dir, "incoming")
+    library = os.path.join(work_dir, "library")
+    version_ids = mock.all_version_ids()[:files]
+    for i, version_id in enumerate(version_ids):
+        folder = os.path.join(incoming, f"batch_{i % 10}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"download_{version_id}.safetensors"), "wb") as f:
+            for chunk in mock.file_content(version_id):
+                f.write(chunk)
+
+    start = time.perf_counter()
+    model_sorter.sort_library(incoming, library_root=library)
+    cold = len(version_ids) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    model_sorter.sort_library(library, library_root=library)
+    warm = len(version_ids) / (time.perf_counter() - start)
+    return cold, warm
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Hide the tools' own output and progress bars unless verbose."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+def bench_watch(mock, work_dir, models):
+    """Check tracked models for new versions twice; returns (cold, warm) models per second."""
+    isolate(work_dir, mock)
+    watch._bulk_query = True
+    download_ledger.record_queued_many([extractor.version_entry(f"https://civitai.com/models/{model_id}", model_id,
+                                                                model_id * 100 + 1, "LORA")
+                                        for model_id in range(1, models + 1)])
+    start = time.perf_counter()
+    watch.check()
+    cold = models / (time.perf_counter() - start)
+    reset_limiters()
+    start = time.perf_counter()
+    watch.check()
+    warm = models / (time.perf_counter() - start)
+    return cold, warm
+
+def run_all(args):
+    """Run every benchmark and return {name: rate}."""
+    mock = MockCivitai(models=max(args.models, args.sort_files, args.download_files),
+                       versions_per_model=2, latency=args.latency,
+                       bandwidth=int(args.bandwidth_mb * MB), error_rate=args.error_rate,
+                       throttle_rate=args.throttle_rate)
+    mock.start()
+    root = tempfile.mkdtemp(prefix="civitai_bench_")
+    results = {}
+    try:
+        with quiet(args.verbose):
+            results["extractor links/s"] = bench_extractor(mock, os.path.join(root, "extractor"), args.models)
+        print("extractor done")
+        for workers in args.workers:
+            work_dir = os.path.join(root, f"download_{workers}")
+            with quiet(args.verbose):
+                rate, cpu_per_gb = bench_downloads(
+                    mock, work_dir, args.download_files, int(args.file_size_mb * MB), workers)
+            results[f"download c{workers} MB/s"] = rate
+            if workers == 1:
+                results["download CPU s/GB"] = cpu_per_gb
+            shutil.rmtree(work_dir)
+            print(f"download with {workers} workers done")
+        with quiet(args.verbose):
+            results["hashing MB/s"] = bench_hashing(os.path.join(root, "hashing"), args.hash_files, args.hash_size_mb)
+        shutil.rmtree(os.path.join(root, "hashing"))
+        print("hashing done")
+        with quiet(args.verbose):
+            cold, warm = bench_sort(mock, os.path.join(root, "sort"), args.sort_files, 256 * 1024)
+        results["sort cold files/s"] = cold
+        results["sort warm files/s"] = warm
+        print("sort done")
+        with quiet(args.verbose):
+            cold, warm = bench_watch(mock, os.path.join(root, "watch"), args.models)
+        results["watch cold models/s"] = cold
+        results["watch warm models/s"] = warm
+        print("watch done")
+    finally:
+        mock.stop()
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print results next to the baseline; returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':<22} {'result':>10} {'baseline':>10} {'change':>8}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base:
+            change = value / base - 1
+            flag = ""
+            if (change > tolerance) if name in LOWER_IS_BETTER else (change < -tolerance):
+                regressions.append(name)
+                flag = "  REGRESSION"
+            print(f"{name:<22} {value:>10.1f} {base:>10.1f} {change:>+7.0%}{flag}")
+        else:
+            print(f"{name:<22} {value:>10.1f} {'-':>10} {'':>8}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller workloads for a fast smoke run")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock response latency in seconds")
+    parser.add_argument("--bandwidth-mb", type=float, default=0.0, help="mock MB/s per connection (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock responses that are 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of mock responses that are 429")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="download concurrencies")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown that counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the tools' own output")
+    args = parser.parse_args()
+    args.models = 20 if args.quick else 100
+    args.download_files = 4 if args.quick else 8
+    args.file_size_mb = 8 if args.quick else 32
+    args.hash_files = 2 if args.quick else 4
+    args.hash_size_mb = 32 if args.quick else 128
+    args.sort_files = 50 if args.quick else 200
+
+    workload = "quick" if args.quick else "full"
+    results = run_all(args)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            saved = json.load(f)
+        if saved.get("workload") == workload:
+            baseline = saved.get("results", {})
+        else:
+            print(f"\nBaseline is for the {saved.get('workload')} workload; not comparing")
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": f"{os.cpu_count()} CPU, {sys.platform}, Python {sys.version.split()[0]}",
+                       "workload": workload,
+                       "results": {name: round(value, 1) for name, value in results.items()}}, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmarks regressed more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Non-interactive command line and library API for the Civitai tools.
+
+The numbered scripts and the rename, hash and dupe tools prompt with
+input(), which cannot run under cron or in a container. This module wraps
+the same code behind subcommands:
+
+    python civitai.py extract [--input urls.txt]
+    python civitai.py download --type loras --jobs 8 [--order smallest]
+    python civitai.py pipeline [--input urls.txt] [--jobs 8]
+    python civitai.py sort FOLDER [--dry-run] [--unknown-type LORA]
+    python civitai.py hash FOLDER [--workers 4]
+    python civitai.py dedupe [ROOTS...] [--link hardlink]
+    python civitai.py queue
+    python civitai.py watch [--interval 3600] [--download] [--add ID...] [--remove ID...]
+
+--jobs is the number of files transferred at once. Each API token allows
+four of them (civitai_client.TOKEN_LIMITS, or concurrency= in
+api_tokens.txt), so with tokens, jobs beyond four per token wait for a
+free slot instead of adding throughput.
+
+Exit codes: 0 on success, 1 when some items failed, 2 for usage errors,
+130 when interrupted.
+
+The functions below are the importable API; each returns a result
+instead of printing an exit status. Modules are imported inside the
+functions, so commands that only touch SQLite (queue, hash, dedupe) start
+without loading requests or tqdm.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+DOWNLOAD_TYPES = ("checkpoints", "loras", "others", "all")
+
+def extract(input_file=None):
+    """Resolve the links in input_file (default urls.txt) into the download queues.
+
+    Returns a dict of counts, or None if the file does not exist.
+    """
+    extractor = importlib.import_module("1_Civitai_link_extractor")
+    return extractor.process_links_file(input_file or extractor.INPUT_FILE)
+
+def download(model_type="all", jobs=None, order=None):
+    """Download the queued URLs of one model type (or all); returns (downloaded, failed).
+
+    order is a scheduling policy: "fifo", "smallest" or "largest".
+    """
+    downloader = importlib.import_module("2_civitai_downloader")
+    workers = jobs or downloader.MAX_WORKERS
+    policy = order or downloader.SCHEDULE_POLICY
+    if model_type == "all":
+        return downloader.process_all_downloads(workers, policy)
+    return downloader.process_downloads(model_type, workers, policy)
+
+def pipeline(input_file=None, jobs=None):
+    """Resolve, download and place every link in input_file; returns a dict of counts."""
+    import pipeline as pipeline_module
+    return pipeline_module.run_pipeline(input_file or pipeline_module.extractor.INPUT_FILE,
+                                        jobs or pipeline_module.downloader.MAX_WORKERS)
+
+def sort(folder, unknown_type=None, dry_run=False, library_root=None):
+    """Sort every model file under folder into the library; returns the move plan."""
+    import model_sorter
+    return model_sorter.sort_library(folder, unknown_type, dry_run, library_root)
+
+def hash_folder(folder, workers=None):
+    """Return {path: sha256} for every model file under folder, using the hash index."""
+    import file_hashing
+    return file_hashing.hash_files(file_hashing.find_model_files(folder), workers)
+
+def dedupe(roots=None, link=None):
+    """Report content duplicates under roots and optionally link them; returns (groups, failed links)."""
+    import dedupe as dedupe_module
+    return dedupe_module.dedupe(roots, link)
+
+def watch(interval=None, download=False, jobs=None):
+    """Check watched models for new versions and queue them; returns the counts of the last check.
+
+    With interval, keeps checking every interval seconds; with download,
+    new versions are downloaded after each check.
+    """
+    import watch as watch_module
+    return watch_module.watch(interval, download, jobs)
+
+def set_watched(add=(), remove=()):
+    """Start watching the model IDs in add and stop watching those in remove."""
+    import download_ledger
+    download_ledger.set_watched(add, True)
+    download_ledger.set_watched(remove, False)
+
+def queue_status():
+    """Return {model_type: {state: count}} for the download queue."""
+    import download_queue
+    return download_queue.status()
+
+def cmd_extract(args):
+    result = extract(args.input)
+    if result is None:
+        return EXIT_FAILURES
+    return EXIT_FAILURES if result["unresolved"] else EXIT_OK
+
+def cmd_download(args):
+    _, failed = download(args.type, args.jobs, args.order)
+    return EXIT_FAILURES if failed else EXIT_OK
+
+def cmd_pipeline(args):
+    result = pipeline(args.input, args.jobs)
+    if not result:
+        return EXIT_FAILURES
+    return EXIT_FAILURES if result["failed"] or result["unresolved"] else EXIT_OK
+
+def cmd_sort(args):
+    if not os.path.isdir(args.folder):
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        return EXIT_USAGE
+    plan = sort(args.folder, args.unknown_type, args.dry_run, args.library_root)
+    if args.dry_run:
+        return EXIT_OK
+    # Anything left in the plan's source paths failed to move
+    return EXIT_FAILURES if any(os.path.exists(path) for path, *_ in plan) else EXIT_OK
+
+def cmd_hash(args):
+    if not os.path.isdir(args.folder):
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        return EXIT_USAGE
+    import file_hashing
+    pruned = file_hashing.prune()
+    if pruned:
+        print(f"Dropped {pruned} hash index entries for deleted files", file=sys.stderr)
+    paths = file_hashing.find_model_files(args.folder)
+    hashes = hash_folder(args.folder, args.workers)
+    for path in paths:
+        if path in hashes:
+            print(f"{hashes[path]}  {path}")
+    return EXIT_OK if len(hashes) == len(paths) else EXIT_FAILURES
+
+def cmd_dedupe(args):
+    _, failed = dedupe(args.roots, args.link)
+    return EXIT_FAILURES if failed else EXIT_OK
+
+def cmd_queue(args):
+    status = queue_status()
+    if not status:
+        print("Download queue is empty")
+    for model_type, counts in sorted(status.items()):
+        print(f"{model_type}: " + ", ".join(f"{state} {count}" for state, count in sorted(counts.items())))
+    return EXIT_OK
+
+def cmd_watch(args):
+    set_watched(args.add, args.remove)
+    counts = watch(args.interval, args.download, args.jobs)
+    return EXIT_FAILURES if counts["error"] else EXIT_OK
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="civitai", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+
+    sub = commands.add_parser("extract", help="resolve links into the download queues")
+    sub.add_argument("--input", default=None, help="file with one Civitai link per line (default: urls.txt)")
+    sub.set_defaults(func=cmd_extract)
+
+    sub = commands.add_parser("download", help="download queued URLs")
+    sub.add_argument("--type", choices=DOWNLOAD_TYPES, default="all", help="queue to drain (default: all)")
+    sub.add_argument("--jobs", type=int, default=None, help="parallel downloads")
+    sub.add_argument("--order", choices=("fifo", "smallest", "largest"), default=None,
+                     help="download order (default: fifo)")
+    sub.set_defaults(func=cmd_download)
+
+    sub = commands.add_parser("pipeline", help="extract, download and place links in one run")
+    sub.add_argument("--input", default=None, help="file with one Civitai link per line (default: urls.txt)")
+    sub.add_argument("--jobs", type=int, default=None, help="parallel downloads")
+    sub.set_defaults(func=cmd_pipeline)
+
+    sub = commands.add_parser("sort", help="name and route model files into <type>/<base model>/")
+    sub.add_argument("folder", help="folder to scan for model files")
+    sub.add_argument("--dry-run", action="store_true", help="print the plan without moving anything")
+    sub.add_argument("--unknown-type", default=None,
+                     help="model type whose folder receives unidentified files (e.g. LORA, Checkpoint)")
+    sub.add_argument("--library-root", default=None, help="library root (default: script directory)")
+    sub.set_defaults(func=cmd_sort)
+
+    sub = commands.add_parser("hash", help="print the SHA256 of every model file in a folder and drop deleted files from the index")
+    sub.add_argument("folder", help="folder to scan for model files")
+    sub.add_argument("--workers", type=int, default=None, help="parallel hashing threads")
+    sub.set_defaults(func=cmd_hash)
+
+    sub = commands.add_parser("dedupe", help="find duplicate model files by content")
+    sub.add_argument("roots", nargs="*", help="folders to scan (default: loras/ and checkpoints/)")
+    sub.add_argument("--link", choices=("hardlink", "reflink"), default=None,
+                     help="replace duplicates with hard links or reflinks (default: report only)")
+    sub.set_defaults(func=cmd_dedupe)
+
+    sub = commands.add_parser("queue", help="show download queue counts")
+    sub.set_defaults(func=cmd_queue)
+
+    sub = commands.add_parser("watch", help="queue new versions of the models in the ledger")
+    sub.add_argument("--interval", type=float, nargs="?", const=3600, default=None,
+                     help="keep checking every INTERVAL seconds (default: check once)")
+    sub.add_argument("--download", action="store_true", help="download new versions after each check")
+    sub.add_argument("--jobs", type=int, default=None, help="parallel downloads")
+    sub.add_argument("--add", type=int, nargs="+", default=[], metavar="MODEL_ID", help="start watching models")
+    sub.add_argument("--remove", type=int, nargs="+", default=[], metavar="MODEL_ID", help="stop watching models")
+    sub.set_defaults(func=cmd_watch)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+"""Shared HTTP client for the Civitai scripts.
+
+Every API and download call goes through one pooled requests.Session, so
+connections are kept alive between calls instead of paying a TCP+TLS
+handshake per request. Transient failures (429/5xx responses and dropped
+connections) are retried with exponential backoff and jitter, honouring
+the server's Retry-After header when it sends one.
+
+Requests are also paced by a client-side limiter per endpoint class
+(metadata API vs. downloads): a token bucket bounds the request rate and
+an in-flight cap bounds concurrency. Both adapt AIMD-style: they grow
+slowly while responses are healthy and halve on 429/503, so the scripts
+settle near the highest rate Civitai tolerates. limiter_stats() reports
+the current values, which are also kept in the civitai_limiter_* gauges.
+
+Every attempt is timed into metrics (civitai_request_seconds, per
+endpoint class). Downloads are requested with stream=True, so for them
+this is the time to first byte, and the download limiter's in-flight slot
+is held until the response is closed.
+
+Requests are authenticated from a pool of API tokens, read from the
+CIVITAI_API_TOKENS (comma separated) or CIVITAI_API_TOKEN environment
+variables and from api_tokens.txt, one token per line, optionally with
+its own download budget:
+
+    0123456789abcdef
+    fedcba9876543210 rate=1 concurrency=2
+
+Each token has its own adaptive limiters (TOKEN_LIMITS), and a streamed
+download holds its token's slot until the response is closed, so the
+concurrency budget counts whole transfers. A request takes the least
+busy token that has budget left. A token answered with 429 sits out for
+Retry-After (or SIDELINE_SECONDS) and the request moves to another one;
+a token answered with 401 is dropped for the rest of the run. With no
+tokens left, requests go out unauthenticated.
+"""
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+
+# Connection pool and retry policy
+POOL_SIZE = 32            # keep-alive connections kept per host
+MAX_RETRIES = 5           # retries after the first attempt
+BACKOFF_BASE = 1.0        # seconds, doubled on every retry
+BACKOFF_MAX = 60.0        # cap for the computed backoff
+RETRY_AFTER_MAX = 600.0   # cap for server-supplied Retry-After values
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_TIMEOUT = (15, 60)  # connect, read seconds
+
+# Adaptive limits per endpoint class: starting, minimum and maximum values
+ENDPOINT_LIMITS = {
+    "metadata": {"rate": 5.0, "min_rate": 0.5, "max_rate": 20.0,
+                 "concurrency": 8, "min_concurrency": 1, "max_concurrency": 16},
+    "download": {"rate": 2.0, "min_rate": 0.2, "max_rate": 10.0,
+                 "concurrency": 4, "min_concurrency": 1, "max_concurrency": 16},
+}
+THROTTLE_STATUSES = {429, 503}
+RATE_INCREASE = 0.1       # req/s added per healthy response
+DECREASE_FACTOR = 0.5     # multiplier applied when throttled
+DECREASE_COOLDOWN = 1.0   # seconds; one burst of 429s only counts once
+
+# API tokens and the budget each one gets per endpoint class
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKENS_FILE = os.environ.get("CIVITAI_TOKENS_FILE") or os.path.join(SCRIPT_DIR, "api_tokens.txt")
+TOKEN_LIMITS = {
+    "metadata": {"rate": 5.0, "min_rate": 0.5, "max_rate": 20.0,
+                 "concurrency": 8, "min_concurrency": 1, "max_concurrency": 16},
+    "download": {"rate": 1.0, "min_rate": 0.1, "max_rate": 5.0,
+                 "concurrency": 4, "min_concurrency": 1, "max_concurrency": 4},
+}
+SIDELINE_SECONDS = 60.0   # how long a throttled token sits out without a Retry-After
+
+_session = None
+_session_lock = threading.Lock()
+_token_pool = None
+_warned_anonymous = False
+
+class AdaptiveLimiter:
+    """Token bucket plus in-flight cap, both adjusted additive-increase/multiplicative-decrease."""
+
+    def __init__(self, rate, min_rate, max_rate, concurrency, min_concurrency, max_concurrency):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.in_flight = 0
+        self.throttled = 0
+        self.updated = time.monotonic()
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token and an in-flight slot if both are free.
+
+        Returns 0 on success, otherwise the seconds until the next token
+        (None when only a slot is missing).
+        """
+        with self.cond:
+            self._refill()
+            if self.tokens >= 1 and self.in_flight < int(self.concurrency):
+                self.tokens -= 1
+                self.in_flight += 1
+                return 0
+            return (1 - self.tokens) / self.rate if self.tokens < 1 else None
+
+    def acquire(self):
+        """Block until a token and an in-flight slot are available."""
+        with self.cond:
+            while True:
+                wait = self.try_acquire()
+                if wait == 0:
+                    return
+                self.cond.wait(timeout=wait)
+
+    def release(self, status_code=None):
+        """Free the slot and adapt the limits to the response status."""
+        with self.cond:
+            self.in_flight -= 1
+            if status_code in THROTTLE_STATUSES:
+                now = time.monotonic()
+                self.throttled += 1
+                if now - self.last_decrease >= DECREASE_COOLDOWN:
+                    self.last_decrease = now
+                    self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+                    self.concurrency = max(self.min_concurrency, self.concurrency * DECREASE_FACTOR)
+            elif status_code is not None and status_code < 500:
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self.cond.notify_all()
+
+    def allow(self, concurrency):
+        """Raise the in-flight cap to at least concurrency, up to max_concurrency."""
+        with self.cond:
+            self.concurrency = max(self.concurrency, float(min(concurrency, self.max_concurrency)))
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {"rate": round(self.rate, 2), "concurrency": int(self.concurrency),
+                    "in_flight": self.in_flight, "throttled": self.throttled}
+
+LIMITERS = {name: AdaptiveLimiter(**limits) for name, limits in ENDPOINT_LIMITS.items()}
+
+class ApiToken:
+    """One API token with its own limiters and sideline state."""
+
+    def __init__(self, secret, name, rate=None, concurrency=None):
+        self.secret = secret
+        self.name = name  # safe to print and log, unlike the secret
+        self.limiters = {}
+        for endpoint, limits in TOKEN_LIMITS.items():
+            limits = dict(limits)
+            if endpoint == "download" and rate is not None:
+                limits["rate"] = limits["max_rate"] = rate
+                limits["min_rate"] = min(limits["min_rate"], rate)
+            if endpoint == "download" and concurrency is not None:
+                limits["concurrency"] = limits["max_concurrency"] = concurrency
+                limits["min_concurrency"] = min(limits["min_concurrency"], concurrency)
+            self.limiters[endpoint] = AdaptiveLimiter(**limits)
+        self.sidelined_until = 0.0
+        self.disabled = False
+
+class TokenPool:
+    """Hands out the least busy API token with budget left, and sidelines throttled ones."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.cond = threading.Condition()
+
+    def live(self):
+        return [token for token in self.tokens if not token.disabled]
+
+    def available(self):
+        """Return True if some token is neither dropped nor sitting out."""
+        now = time.monotonic()
+        with self.cond:
+            return any(token.sidelined_until <= now for token in self.live())
+
+    def acquire(self, endpoint):
+        """Block until a token has budget for endpoint; returns None if every token was dropped."""
+        with self.cond:
+            while True:
+                live = self.live()
+                if not live:
+                    return None
+                now = time.monotonic()
+                ready = [token for token in live if token.sidelined_until <= now]
+                waits = [token.sidelined_until - now for token in live if token.sidelined_until > now]
+                for token in sorted(ready, key=lambda token: token.limiters[endpoint].in_flight):
+                    wait = token.limiters[endpoint].try_acquire()
+                    if wait == 0:
+                        return token
+                    if wait is not None:
+                        waits.append(wait)
+                # Releases notify, so only rate and sideline waits need a timeout
+                self.cond.wait(timeout=min(waits) if waits else None)
+
+    def report(self, token, status_code, retry_after=None):
+        """Sideline a token on 429 or drop it on 401."""
+        with self.cond:
+            if status_code == 401 and not token.disabled:
+                token.disabled = True
+                metrics.inc("civitai_token_sidelined_total", token=token.name, reason="401")
+                print(f"Civitai rejected API token {token.name} (401); dropped it for this run")
+            elif status_code == 429:
+                token.sidelined_until = time.monotonic() + (retry_after or SIDELINE_SECONDS)
+                metrics.inc("civitai_token_sidelined_total", token=token.name, reason="429")
+            self.cond.notify_all()
+
+    def release(self, token, endpoint, status_code=None):
+        """Free the token's slot for endpoint."""
+        token.limiters[endpoint].release(status_code)
+        with self.cond:
+            self.cond.notify_all()
+
+    def stats(self):
+        now = time.monotonic()
+        return {token.name: {"disabled": token.disabled,
+                             "sidelined": round(max(0.0, token.sidelined_until - now), 1),
+                             **{endpoint: limiter.stats() for endpoint, limiter in token.limiters.items()}}
+                for token in self.tokens}
+
+def parse_tokens(text):
+    """Parse token lines ("<token> [rate=N] [concurrency=N]", # comments) into ApiTokens."""
+    tokens = []
+    for line in text.splitlines():
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        options = dict(field.split("=", 1) for field in fields[1:] if "=" in field)
+        rate = float(options["rate"]) if "rate" in options else None
+        concurrency = int(options["concurrency"]) if "concurrency" in options else None
+        tokens.append(ApiToken(fields[0], f"#{len(tokens) + 1} ...{fields[0][-4:]}", rate, concurrency))
+    return tokens
+
+def load_tokens():
+    """Read API tokens from the environment and TOKENS_FILE, without duplicates."""
+    text = "\n".join(os.environ.get(name, "").replace(",", "\n")
+                     for name in ("CIVITAI_API_TOKENS", "CIVITAI_API_TOKEN"))
+    if os.path.exists(TOKENS_FILE):
+        with open(TOKENS_FILE, "r", encoding="utf-8") as f:
+            text += "\n" + f.read()
+    lines, seen = [], set()
+    for line in text.splitlines():
+        secret = line.split("#", 1)[0].split()[:1]
+        if secret and secret[0] not in seen:
+            seen.add(secret[0])
+            lines.append(line)
+    return parse_tokens("\n".join(lines))
+
+def get_token_pool():
+    """Return the process-wide token pool, loading the tokens on first use."""
+    global _token_pool
+    with _session_lock:
+        if _token_pool is None:
+            _token_pool = TokenPool(load_tokens())
+        return _token_pool
+
+def token_stats():
+    """Return the state and limits of every API token."""
+    return get_token_pool().stats()
+
+def endpoint_class(url):
+    """Return the limiter class for a URL: "download" or "metadata"."""
+    return "download" if "/api/download/" in url else "metadata"
+
+def limiter_stats():
+    """Return the current rate, concurrency and throttle count per endpoint class."""
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
+
+def allow_concurrency(endpoint, concurrency):
+    """Let an endpoint class run at least concurrency requests at once (within its maximum)."""
+    LIMITERS[endpoint].allow(concurrency)
+
+def configure(pool_size=None, max_retries=None, tokens=None):
+    """Change pool size, retry count or API tokens; the next request builds a fresh session.
+
+    tokens is a list of token strings (or token file lines) that replaces
+    the tokens loaded from the environment and TOKENS_FILE.
+    """
+    global POOL_SIZE, MAX_RETRIES, _session, _token_pool
+    with _session_lock:
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if max_retries is not None:
+            MAX_RETRIES = max_retries
+        if tokens is not None:
+            _token_pool = TokenPool(parse_tokens("\n".join(tokens)))
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+        return _session
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_delay(attempt, response=None):
+    """Return how long to sleep before retry number attempt (1-based)."""
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, RETRY_AFTER_MAX)
+    # Full jitter keeps parallel workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+def record_attempt(endpoint, method, url, status, seconds, attempt, **fields):
+    """Record one HTTP attempt in the metrics and the event log."""
+    metrics.observe("civitai_request_seconds", seconds, endpoint=endpoint)
+    metrics.inc("civitai_responses_total", endpoint=endpoint, status=str(status))
+    metrics.event("api_request", endpoint=endpoint, method=method, url=url, status=status,
+                  seconds=round(seconds, 4), attempt=attempt, **fields)
+
+def publish_limiter(endpoint):
+    """Copy an endpoint limiter's current limits and load into the metrics gauges."""
+    stats = LIMITERS[endpoint].stats()
+    metrics.set_gauge("civitai_limiter_rate", stats["rate"], endpoint=endpoint)
+    metrics.set_gauge("civitai_limiter_concurrency", stats["concurrency"], endpoint=endpoint)
+    metrics.set_gauge("civitai_limiter_in_flight", stats["in_flight"], endpoint=endpoint)
+
+def release_attempt(limiter, endpoint, pool, token, status_code=None):
+    """Free the endpoint limiter's slot and the token's, if one was taken."""
+    limiter.release(status_code)
+    if token is not None:
+        pool.release(token, endpoint, status_code)
+    publish_limiter(endpoint)
+
+def release_on_close(response, release):
+    """Call release once, when a streamed response is closed."""
+    close = response.close
+    released = []
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released:
+                released.append(True)
+                release()
+    response.close = close_and_release
+
+def warn_anonymous(url):
+    """Point at the token settings the first time an unauthenticated request gets a 401."""
+    global _warned_anonymous
+    if not _warned_anonymous:
+        _warned_anonymous = True
+        print(f"Civitai requires an API token for {url}; set CIVITAI_API_TOKEN "
+              f"or add tokens to {TOKENS_FILE}")
+
+def request(method, url, **kwargs):
+    """Send a request through the shared session, retrying transient failures.
+
+    Every attempt first waits for the endpoint class's adaptive limiter,
+    then takes an API token from the pool unless the caller sent its own
+    Authorization header. Returns the last response received, which may
+    still carry an error status once retries are exhausted; connection
+    errors are re-raised.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    session = get_session()
+    endpoint = endpoint_class(url)
+    limiter = LIMITERS[endpoint]
+    caller_headers = kwargs.pop("headers", None) or {}
+    pool = None if "Authorization" in caller_headers else get_token_pool()
+    attempt = 0
+    while True:
+        attempt += 1
+        token = pool.acquire(endpoint) if pool is not None else None
+        headers = dict(caller_headers)
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token.secret}"
+        limiter.acquire()
+        publish_limiter(endpoint)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, headers=headers, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            release_attempt(limiter, endpoint, pool, token)
+            record_attempt(endpoint, method, url, "error", time.perf_counter() - start, attempt, error=str(e))
+            if attempt > MAX_RETRIES:
+                raise
+            metrics.inc("civitai_retries_total", endpoint=endpoint)
+            time.sleep(retry_delay(attempt))
+            continue
+        except Exception:
+            release_attempt(limiter, endpoint, pool, token)
+            raise
+        status = response.status_code
+        try:
+            record_attempt(endpoint, method, url, status, time.perf_counter() - start, attempt,
+                           token=token.name if token is not None else None)
+        except Exception:
+            release_attempt(limiter, endpoint, pool, token, status)
+            response.close()
+            raise
+        if token is not None:
+            pool.report(token, status, parse_retry_after(response.headers.get("Retry-After")))
+            if status == 401:
+                # A rejected token does not use up a retry; the next attempt takes another one
+                release_attempt(limiter, endpoint, pool, token, status)
+                response.close()
+                attempt -= 1
+                continue
+        elif status == 401:
+            warn_anonymous(url)
+        if status not in RETRY_STATUSES or attempt > MAX_RETRIES:
+            if kwargs.get("stream"):
+                # Hold the limiter's and the token's slots for the whole transfer
+                release_on_close(response, lambda: release_attempt(limiter, endpoint, pool, token, status))
+            else:
+                release_attempt(limiter, endpoint, pool, token, status)
+            return response
+        release_attempt(limiter, endpoint, pool, token, status)
+        metrics.inc("civitai_retries_total", endpoint=endpoint)
+        response.close()
+        if status == 429 and token is not None and pool.available():
+            continue  # another token can take it right away
+        time.sleep(retry_delay(attempt, response))
+
+def get(url, **kwargs):
+    """GET url through the shared session with retries."""
+    return request("GET", url, **kwargs)
@@ -0,0 +1,193 @@
+"""Find and reclaim duplicate model files by content.
+
+Duplicates are found in stages, so most bytes are never read:
+
+1. files are grouped by size; a size seen once cannot be a duplicate
+2. same-size files are grouped by a partial hash of their first and last
+   PARTIAL_BLOCK bytes (or by their full SHA256 when the hash index already
+   has it for every file of that size)
+3. only files that still collide are fully hashed, through the hash index
+
+Hard links to the same inode count as one file. Each extra copy is then
+replaced by a hard link or a reflink (copy-on-write clone, on filesystems
+that support it) to the copy that is kept, so every path keeps working and
+the space is freed. Nothing is deleted.
+
+    python dedupe.py                       # report duplicates in loras/ and checkpoints/
+    python dedupe.py --link hardlink       # reclaim them with hard links
+    python dedupe.py D:/models --link reflink
+"""
+import argparse
+import hashlib
+import os
+import re
+from collections import defaultdict
+
+import file_hashing
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROOTS = [os.path.join(SCRIPT_DIR, "loras"), os.path.join(SCRIPT_DIR, "checkpoints")]
+PARTIAL_BLOCK = 1024 * 1024  # bytes read from each end of a file for the partial hash
+LINK_MODES = ("hardlink", "reflink")
+FICLONE = 0x40049409         # Linux ioctl: clone a whole file (btrfs, XFS, bcachefs)
+TEMP_SUFFIX = ".dedupe-tmp"
+
+def partial_hash(file_path, size):
+    """Hash the size and the first and last PARTIAL_BLOCK bytes of a file."""
+    digest = hashlib.sha256(str(size).encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(PARTIAL_BLOCK))
+        if size > PARTIAL_BLOCK:
+            f.seek(max(PARTIAL_BLOCK, size - PARTIAL_BLOCK))
+            digest.update(f.read(PARTIAL_BLOCK))
+    return digest.hexdigest()
+
+def group_by(paths, key_func):
+    """Group paths by key_func(path), keeping only groups with more than one member."""
+    groups = defaultdict(list)
+    for path in paths:
+        try:
+            groups[key_func(path)].append(path)
+        except OSError as e:
+            print(f"Error reading {path}: {e}")
+    return [members for members in groups.values() if len(members) > 1]
+
+def find_duplicates(roots):
+    """Return lists of paths with identical content under roots, largest files first.
+
+    Within a list every path is a different inode; paths that are already
+    hard links to each other are reported once.
+    """
+    stats = {}
+    seen_inodes = set()
+    for root in roots:
+        for path in file_hashing.find_model_files(root):
+            path = os.path.abspath(path)
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                # Deleted or replaced since the walk listed it
+                print(f"Error reading {path}: {e}")
+                continue
+            if st.st_size == 0 or (st.st_dev, st.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((st.st_dev, st.st_ino))
+            stats[path] = st
+
+    size_groups = group_by(stats, lambda path: stats[path].st_size)
+
+    candidates = []
+    for members in size_groups:
+        # Skip the partial read when the index already knows every full hash
+        indexed = {path: file_hashing.lookup(path, stats[path]) for path in members}
+        if all(indexed.values()):
+            candidates.extend(group_by(members, indexed.get))
+        else:
+            candidates.extend(group_by(members, lambda path: partial_hash(path, stats[path].st_size)))
+
+    to_hash = [path for group in candidates for path in group]
+    hashes = file_hashing.hash_files(to_hash)
+    duplicates = [group for members in candidates
+                  for group in group_by([path for path in members if path in hashes], hashes.get)]
+    duplicates.sort(key=lambda group: stats[group[0]].st_size, reverse=True)
+    return [sorted(group, key=keeper_rank) for group in duplicates]
+
+def keeper_rank(path):
+    """Sort key that puts the copy to keep first: no (n) suffix, then the shortest path."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return (re.search(r"\(\d+\)$", stem) is not None, len(path), path)
+
+def reflink(source, target):
+    """Create target as a copy-on-write clone of source."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def replace_with_link(keeper, duplicate, mode):
+    """Atomically replace duplicate with a hard link or reflink to keeper."""
+    temp_path = duplicate + TEMP_SUFFIX
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        if mode == "hardlink":
+            os.link(keeper, temp_path)
+        else:
+            reflink(keeper, temp_path)
+            st = os.stat(duplicate)
+            os.utime(temp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(temp_path, duplicate)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def reclaim(groups, mode):
+    """Link every duplicate to the first path of its group; returns (bytes freed, failed links)."""
+    if mode not in LINK_MODES:
+        raise ValueError(f"mode must be one of {LINK_MODES}")
+    freed = 0
+    failed = 0
+    for keeper, *duplicates in groups:
+        sha256 = file_hashing.get_file_hash(keeper)
+        for duplicate in duplicates:
+            try:
+                # Confirm the content right before replacing it
+                if file_hashing.get_file_hash(duplicate) != sha256:
+                    print(f"Skipped {duplicate}: changed since it was scanned")
+                    continue
+                size = os.path.getsize(duplicate)
+                replace_with_link(keeper, duplicate, mode)
+            except OSError as e:
+                print(f"Error linking {duplicate}: {e}")
+                failed += 1
+                continue
+            file_hashing.record(duplicate, os.stat(duplicate), sha256)
+            freed += size
+            print(f"Linked {duplicate} -> {keeper}")
+    return freed, failed
+
+def format_size(size):
+    """Return a byte count as a human-readable string."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def dedupe(roots=None, mode=None):
+    """Report duplicates under roots and, if mode is given, reclaim them.
+
+    Returns (groups, failed), where failed counts the duplicates that could
+    not be linked.
+    """
+    groups = find_duplicates(roots or DEFAULT_ROOTS)
+    wasted = 0
+    for group in groups:
+        size = os.path.getsize(group[0])
+        wasted += size * (len(group) - 1)
+        print(f"\n{format_size(size)} x {len(group)}")
+        for i, path in enumerate(group):
+            print(f"  {'keep' if i == 0 else 'dupe'}  {path}")
+    print(f"\n{len(groups)} duplicate groups, {format_size(wasted)} reclaimable")
+    failed = 0
+    if mode and groups:
+        freed, failed = reclaim(groups, mode)
+        print(f"Reclaimed {format_size(freed)}")
+    return groups, failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("roots", nargs="*", help="folders to scan (default: loras/ and checkpoints/)")
+    parser.add_argument("--link", choices=LINK_MODES, default=None,
+                        help="replace duplicates with hard links or reflinks (default: report only)")
+    args = parser.parse_args()
+    dedupe(args.roots, args.link)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Indexed ledger of resolved and downloaded model versions.
+
+Replaces processed_urls.log and the *_downloaded.log files. Those were
+loaded into memory on every start and keyed by raw URL, so
+/models/123 and /models/123?modelVersionId=456 looked unrelated. The
+ledger (download_ledger.sqlite) is keyed by Civitai version ID, which is
+globally unique, and also indexes the model ID. Each version row records
+where the file went, its size, SHA256, model type and timestamps, plus
+the model-versions metadata the extractor resolved (without the image
+list), so later steps can name, route and identify the file without
+asking the API again. Membership checks are single indexed lookups.
+
+Every model in the ledger is also watched for new versions (watch.py);
+the models table keeps each model's last seen version list and the
+ETag/Last-Modified of the answer it came from.
+
+The old log files are imported once, the first time the ledger is opened,
+and are left on disk untouched.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LEDGER_FILE = os.path.join(SCRIPT_DIR, "download_ledger.sqlite")
+
+# Flat logs imported by migrate_logs(), download logs keyed by downloader queue
+PROCESSED_LOG = os.path.join(SCRIPT_DIR, "processed_urls.log")
+DOWNLOAD_LOGS = {
+    'checkpoints': os.path.join(SCRIPT_DIR, "checkpoints_downloaded.log"),
+    'loras': os.path.join(SCRIPT_DIR, "loras_downloaded.log"),
+    'others': os.path.join(SCRIPT_DIR, "others_downloaded.log"),
+}
+
+# model_type holds the API's model.type; this maps downloader queues onto it
+CATEGORY_TYPES = {'checkpoints': 'Checkpoint', 'loras': 'LORA', 'others': None}
+
+# Columns added to models for watch mode, with their definitions
+WATCH_COLUMNS = {
+    'watch': "INTEGER NOT NULL DEFAULT 1",
+    'etag': "TEXT",
+    'last_modified': "TEXT",
+    'version_ids': "TEXT",   # JSON list of the version IDs seen at the last check
+    'checked_at': "REAL",
+}
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's connection to the ledger, migrating old logs on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(LEDGER_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # One schema check at a time, or two threads both add the same missing column
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            " version_id INTEGER PRIMARY KEY,"
+            " model_id INTEGER,"
+            " model_type TEXT,"
+            " source_url TEXT,"
+            " file_path TEXT,"
+            " size INTEGER,"
+            " sha256 TEXT,"
+            " queued_at REAL,"
+            " downloaded_at REAL,"
+            " metadata TEXT)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(versions)")}
+        if "metadata" not in columns:
+            conn.execute("ALTER TABLE versions ADD COLUMN metadata TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS versions_model ON versions (model_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS versions_sha256 ON versions (sha256)")
+        # Models seen in any link, plus their watch state
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS models ("
+            " model_id INTEGER PRIMARY KEY,"
+            " source_url TEXT,"
+            " seen_at REAL NOT NULL)"
+        )
+        model_columns = {row[1] for row in conn.execute("PRAGMA table_info(models)")}
+        for column, definition in WATCH_COLUMNS.items():
+            if column not in model_columns:
+                conn.execute(f"ALTER TABLE models ADD COLUMN {column} {definition}")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+        _local.conn = conn
+        migrate_logs(conn)
+    return conn
+
+def parse_ids(url):
+    """Return (model_id, version_id) as ints (or None) for any Civitai URL.
+
+    Handles model pages (/models/1?modelVersionId=2) and download links
+    (/api/download/models/2, where the number is a version ID).
+    """
+    download_match = re.search(r'/download/models/(\d+)', url)
+    if download_match:
+        return None, int(download_match.group(1))
+    model_match = re.search(r'models/(\d+)', url)
+    version_match = re.search(r'modelVersionId=(\d+)', url)
+    return (int(model_match.group(1)) if model_match else None,
+            int(version_match.group(1)) if version_match else None)
+
+def migrate_logs(conn):
+    """Import processed_urls.log and *_downloaded.log once."""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_logs'").fetchone():
+        return
+    now = time.time()
+    with conn:
+        if os.path.exists(PROCESSED_LOG):
+            with open(PROCESSED_LOG, 'r') as file:
+                for line in file:
+                    url = line.strip()
+                    if url:
+                        model_id, version_id = parse_ids(url)
+                        _upsert(conn, model_id, version_id, source_url=url, queued_at=now)
+        for category, log_file in DOWNLOAD_LOGS.items():
+            if not os.path.exists(log_file):
+                continue
+            with open(log_file, 'r') as file:
+                for line in file:
+                    url, _, rest = line.strip().partition(' | ')
+                    sha256 = rest.split('SHA256: ', 1)[1] if 'SHA256: ' in rest else None
+                    _, version_id = parse_ids(url)
+                    _upsert(conn, None, version_id, model_type=CATEGORY_TYPES[category], sha256=sha256,
+                            downloaded_at=now)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_logs', ?)", (str(now),))
+
+def _upsert(conn, model_id, version_id, **fields):
+    """Insert or update a ledger row, keeping existing values for fields passed as None."""
+    if model_id is not None:
+        conn.execute("INSERT OR IGNORE INTO models (model_id, source_url, seen_at) VALUES (?, ?, ?)",
+                     (model_id, fields.get('source_url'), time.time()))
+    if version_id is None:
+        return
+    conn.execute("INSERT OR IGNORE INTO versions (version_id) VALUES (?)", (version_id,))
+    fields['model_id'] = model_id
+    updates = {name: value for name, value in fields.items() if value is not None}
+    if updates:
+        assignments = ", ".join(f"{name} = ?" for name in updates)
+        conn.execute(f"UPDATE versions SET {assignments} WHERE version_id = ?",
+                     (*updates.values(), version_id))
+
+def is_processed(url):
+    """Return True if the version (or, for a plain model link, the model) is already known."""
+    model_id, version_id = parse_ids(url)
+    conn = get_connection()
+    if version_id is not None:
+        return conn.execute("SELECT 1 FROM versions WHERE version_id = ?", (version_id,)).fetchone() is not None
+    if model_id is not None:
+        return conn.execute("SELECT 1 FROM models WHERE model_id = ?", (model_id,)).fetchone() is not None
+    return False
+
+def is_downloaded(url):
+    """Return True if the version behind a download URL has been downloaded."""
+    _, version_id = parse_ids(url)
+    if version_id is None:
+        return False
+    row = get_connection().execute(
+        "SELECT downloaded_at FROM versions WHERE version_id = ?", (version_id,)
+    ).fetchone()
+    return bool(row and row[0])
+
+def record_queued_many(entries):
+    """Record a batch of queued versions in one transaction.
+
+    Each entry is a dict with model_id, version_id, model_type and
+    source_url, and optionally the version's API metadata.
+    """
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        for entry in entries:
+            metadata = entry.get('metadata')
+            if metadata:
+                metadata = json.dumps({k: v for k, v in metadata.items() if k != 'images'}, separators=(',', ':'))
+            _upsert(conn, entry['model_id'], entry['version_id'], model_type=entry['model_type'],
+                    source_url=entry['source_url'], queued_at=now, metadata=metadata)
+
+def record_download(url, model_type, file_path, size, sha256, model_id=None):
+    """Record a completed download for the version behind url."""
+    _, version_id = parse_ids(url)
+    conn = get_connection()
+    with conn:
+        _upsert(conn, model_id, version_id, model_type=model_type, file_path=file_path,
+                size=size, sha256=sha256, downloaded_at=time.time())
+
+def update_file_paths(moves):
+    """Point downloaded versions at new file locations, given (version_id, path) pairs."""
+    conn = get_connection()
+    with conn:
+        conn.executemany("UPDATE versions SET file_path = ? WHERE version_id = ?",
+                         [(file_path, version_id) for version_id, file_path in moves])
+
+def get_metadata(version_id):
+    """Return the stored API metadata for a version, or None."""
+    row = get_connection().execute("SELECT metadata FROM versions WHERE version_id = ?", (version_id,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+def metadata_for_hash(sha256):
+    """Return the stored API metadata for the version whose file has this SHA256, or None."""
+    row = get_connection().execute(
+        "SELECT metadata FROM versions WHERE sha256 = ? AND metadata IS NOT NULL", (sha256.lower(),)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def get_meta(key):
+    """Return a value from the ledger's key/value table, or None."""
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_meta(key, value):
+    """Store a value in the ledger's key/value table."""
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def watched_models():
+    """Return the watched models as dicts, version_ids as a list (None before the first check)."""
+    cursor = get_connection().execute(
+        "SELECT model_id, etag, last_modified, version_ids, checked_at FROM models"
+        " WHERE watch = 1 ORDER BY model_id"
+    )
+    columns = [column[0] for column in cursor.description]
+    models = [dict(zip(columns, row)) for row in cursor]
+    for model in models:
+        model['version_ids'] = json.loads(model['version_ids']) if model['version_ids'] else None
+    return models
+
+def set_watched(model_ids, watch=True):
+    """Start or stop watching models; models not in the ledger yet are added."""
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        for model_id in model_ids:
+            conn.execute("INSERT OR IGNORE INTO models (model_id, source_url, seen_at) VALUES (?, ?, ?)",
+                         (model_id, f"https://civitai.com/models/{model_id}", now))
+            conn.execute("UPDATE models SET watch = ? WHERE model_id = ?", (int(watch), model_id))
+
+def record_checks(checks):
+    """Store watch check results in one transaction.
+
+    checks holds (model_id, version_ids, etag, last_modified) tuples; the
+    last three may be left out or None to keep what was stored.
+    """
+    conn = get_connection()
+    now = time.time()
+    rows = []
+    for model_id, version_ids, etag, last_modified in ((*check, None, None, None)[:4] for check in checks):
+        rows.append((json.dumps(version_ids) if version_ids is not None else None, etag, last_modified,
+                     now, model_id))
+    with conn:
+        conn.executemany(
+            "UPDATE models SET version_ids = COALESCE(?, version_ids), etag = COALESCE(?, etag),"
+            " last_modified = COALESCE(?, last_modified), checked_at = ? WHERE model_id = ?",
+            rows,
+        )
+
+def version_ids_for_model(model_id):
+    """Return the IDs of every version of a model in the ledger."""
+    rows = get_connection().execute("SELECT version_id FROM versions WHERE model_id = ?", (model_id,))
+    return {row[0] for row in rows}
@@ -0,0 +1,135 @@
+"""Crash-safe work queue for the downloader.
+
+Queued download URLs live in download_queue.sqlite with one row per
+(model type, URL) and a state of pending, in_progress, done or failed.
+Every state change is a single indexed UPDATE, so draining a long queue
+costs O(1) per URL instead of rewriting the whole .txt file, and a crash
+can never truncate the queue. URLs that were in progress when a run died
+go back to pending on the next run.
+
+The plain checkpoints.txt/loras.txt/others.txt files stay the input
+format: import_file() claims each file by renaming it, moves its lines
+into the queue and then deletes it.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+QUEUE_FILE = os.path.join(SCRIPT_DIR, "download_queue.sqlite")
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+IMPORTING_SUFFIX = ".importing"  # a .txt queue file claimed by import_file()
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's connection to the queue database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(QUEUE_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " model_type TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " added_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " UNIQUE (model_type, url))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (model_type, state, id)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+def add_urls(model_type, urls):
+    """Queue URLs as pending; a URL that previously failed is queued again."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO jobs (model_type, url, state, added_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (model_type, url) DO UPDATE SET state = excluded.state,"
+            " updated_at = excluded.updated_at WHERE jobs.state = ?",
+            [(model_type, url, PENDING, now, now, FAILED) for url in urls],
+        )
+
+def import_claimed(model_type, claimed):
+    """Queue the URLs of a claimed queue file, then delete it; returns their count."""
+    with open(claimed, 'r') as file:
+        urls = [line.strip() for line in file if line.strip()]
+    if urls:
+        add_urls(model_type, urls)
+    os.remove(claimed)
+    return len(urls)
+
+def import_file(model_type, file_path):
+    """Move the URLs listed in a .txt queue file into the queue.
+
+    The file is claimed by renaming it to file_path + IMPORTING_SUFFIX, so
+    lines appended while it is read go to a fresh file instead of being
+    lost, and the claimed copy is deleted only after its URLs are
+    committed. A copy left behind by a crash is imported first. Returns
+    the number of URLs read.
+    """
+    claimed = file_path + IMPORTING_SUFFIX
+    imported = import_claimed(model_type, claimed) if os.path.exists(claimed) else 0
+    try:
+        os.replace(file_path, claimed)
+    except FileNotFoundError:
+        return imported
+    except PermissionError:
+        # Windows refuses while another script has the file open; it is picked up next run
+        print(f"{os.path.basename(file_path)} is in use, importing it next time")
+        return imported
+    return imported + import_claimed(model_type, claimed)
+
+def recover(model_type=None):
+    """Return jobs left in progress by an interrupted run to pending."""
+    conn = get_connection()
+    with conn:
+        if model_type is None:
+            conn.execute("UPDATE jobs SET state = ? WHERE state = ?", (PENDING, IN_PROGRESS))
+        else:
+            conn.execute("UPDATE jobs SET state = ? WHERE state = ? AND model_type = ?",
+                         (PENDING, IN_PROGRESS, model_type))
+
+def pending_urls(model_type):
+    """Return the pending URLs for a model type in the order they were queued."""
+    rows = get_connection().execute(
+        "SELECT url FROM jobs WHERE model_type = ? AND state = ? ORDER BY id", (model_type, PENDING)
+    )
+    return [url for (url,) in rows]
+
+def mark(model_type, url, state):
+    """Move one queued URL to a new state."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE model_type = ? AND url = ?",
+            (state, time.time(), model_type, url),
+        )
+
+def counts(model_type=None):
+    """Return {state: number of jobs}, optionally for one model type."""
+    query = "SELECT state, COUNT(*) FROM jobs"
+    params = ()
+    if model_type is not None:
+        query += " WHERE model_type = ?"
+        params = (model_type,)
+    return dict(get_connection().execute(query + " GROUP BY state", params).fetchall())
+
+def status():
+    """Return {model_type: {state: number of jobs}} for the whole queue."""
+    result = {}
+    for model_type, state, count in get_connection().execute(
+            "SELECT model_type, state, COUNT(*) FROM jobs GROUP BY model_type, state"):
+        result.setdefault(model_type, {})[state] = count
+    return result
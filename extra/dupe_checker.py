@@ -1,4 +1,8 @@
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import dedupe
 
 PREDEFINED_TYPES = {
     '1': 'flux',
@@ -106,16 +110,31 @@ def process_type(type_name):
         
     check_duplicates(log_file_path, folder_path)
 
+def content_dedupe():
+    """Find copies by content across loras/ and checkpoints/ and offer to link them."""
+    groups, _ = dedupe.dedupe()
+    if not groups:
+        return
+    response = input("\nReplace the duplicates with hard links to the kept copy? (yes/no): ").lower()
+    if response == 'yes':
+        freed, _ = dedupe.reclaim(groups, 'hardlink')
+        print(f"Reclaimed {dedupe.format_size(freed)}")
+    else:
+        print("No files were changed")
+
 def main():
     print("Duplicate File Checker and Remover")
     print("=" * 30)
     print("\nAvailable options:")
     for key, value in PREDEFINED_TYPES.items():
         print(f"{key}. {value}")
+    print("9. content (find renamed copies in loras/ and checkpoints/ by hash)")
     
-    choice = input("\nSelect option (1-8): ").strip()
+    choice = input("\nSelect option (1-9): ").strip()
     
-    if choice == '8':  # Custom paths
+    if choice == '9':
+        content_dedupe()
+    elif choice == '8':  # Custom paths
         log_file_path = input("Enter the path to your log file: ").strip('"')
         folder_path = input("Enter the path to the folder to check: ").strip('"')
         check_duplicates(log_file_path, folder_path)
@@ -1,20 +1,9 @@
 import os
-import hashlib
-import requests
+import sys
 
-def get_file_hash(file_path, algo="sha256"):
-    hash_func = hashlib.new(algo)
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_func.update(chunk)
-    return hash_func.hexdigest()
-
-def check_civitai(hash_value):
-    url = f"https://civitai.com/api/v1/model-versions/by-hash/{hash_value}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    return None
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import file_hashing
+import model_sorter
 
 def get_folder_path():
     print("Select an option:")
@@ -39,27 +28,40 @@ if __name__ == "__main__":
     if folder_path is None:
         print("Exiting the script due to invalid input.")
     else:
-        # Create or open both files for writing
+        # Hash every model file up front on the worker pool
+        hashes = file_hashing.hash_files(file_hashing.find_model_files(folder_path))
+
+        # Identify all distinct hashes in one batched, cached lookup; an
+        # interrupted run resumes from the hash index and the API cache
+        unique_hashes = set(hashes.values())
+        print(f"Looking up {len(unique_hashes)} distinct hashes for {len(hashes)} files")
+        found = model_sorter.lookup_metadata_many(unique_hashes)
+
+        # Write both result files in one pass
+        written = set()
+        failed = 0
         with open("checkpoints_download.txt", "w", encoding="utf-8") as url_file, \
              open("checkpoints_hash_not_found.txt", "w", encoding="utf-8") as not_found_file:
             
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    if file.endswith(".safetensors"):
-                        file_path = os.path.join(root, file)
-                        print(f"Processing: {file}")
-                        
-                        file_hash = get_file_hash(file_path)
-                        data = check_civitai(file_hash)
-                        
-                        if data and "id" in data and "modelId" in data:
-                            version_id = data["id"]
-                            model_id = data["modelId"]
-                            base_url, version_url = create_urls(model_id, version_id)
-                            url_file.write(f"{base_url}\n{version_url}\n")
-                        else:
-                            rel_path = os.path.relpath(file_path, folder_path)
-                            not_found_file.write(f"{rel_path}\n")
+            for file_path, file_hash in hashes.items():
+                if file_hash not in found:
+                    # The lookup failed (network error, 429, 5xx); not cached, so the next run asks again
+                    failed += 1
+                    continue
+                data = found[file_hash]
+                
+                if data and "id" in data and "modelId" in data:
+                    version_id = data["id"]
+                    if version_id in written:
+                        continue
+                    written.add(version_id)
+                    base_url, version_url = create_urls(data["modelId"], version_id)
+                    url_file.write(f"{base_url}\n{version_url}\n")
+                else:
+                    rel_path = os.path.relpath(file_path, folder_path)
+                    not_found_file.write(f"{rel_path}\n")
+        if failed:
+            print(f"{failed} files could not be looked up; run again to retry them")
 
     print("Done. URLs saved to checkpoints_download.txt")
     print("Files not found saved to checkpoint_hash_not_found.txt")
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""Shared file hashing with a persistent hash index.
+
+Hashing a multi-TB model library takes hours, so every computed SHA256 is
+recorded in hash_index.sqlite together with the file's path, size,
+mtime_ns and inode. A file whose stat still matches its row is never read
+again, and a file that was moved or renamed on the same volume is
+recognised by its inode instead of being hashed again.
+
+Files that do need hashing are read in large blocks into a reused buffer
+and hashed on a thread pool; hashlib releases the GIL while digesting big
+buffers, so HASH_WORKERS threads keep both the disk and the cores busy.
+Keep HASH_WORKERS low (1-2) on spinning disks, higher on NVMe.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILE = os.path.join(SCRIPT_DIR, "hash_index.sqlite")
+READ_SIZE = 8 * 1024 * 1024
+HASH_WORKERS = 4
+MODEL_EXTENSIONS = (".safetensors",)
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's connection to the hash index."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(INDEX_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " device INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " autov2 TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS files_inode ON files (device, inode)")
+        conn.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+def update_from_file(hash_func, file_path, length=None):
+    """Feed a file's first length bytes (the whole file when None) into hash_func."""
+    buffer = bytearray(READ_SIZE)
+    view = memoryview(buffer)
+    remaining = length
+    with open(file_path, "rb", buffering=0) as f:
+        while remaining is None or remaining > 0:
+            size = f.readinto(buffer if remaining is None or remaining >= READ_SIZE else view[:remaining])
+            if not size:
+                break
+            hash_func.update(view[:size])
+            if remaining is not None:
+                remaining -= size
+    return hash_func
+
+def hash_file(file_path, algo="sha256"):
+    """Hash a file's contents without consulting the index."""
+    return update_from_file(hashlib.new(algo), file_path).hexdigest()
+
+def autov2_hash(sha256):
+    """Return Civitai's AutoV2 short hash (first 10 hex digits of the SHA256)."""
+    return sha256[:10].upper()
+
+def lookup(file_path, st):
+    """Return the indexed SHA256 for an unchanged file, or None."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT sha256 FROM files WHERE path = ? AND size = ? AND mtime_ns = ? AND device = ? AND inode = ?",
+        (file_path, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino),
+    ).fetchone()
+    if row:
+        return row[0]
+    # Same inode, size and mtime under another path: the file was moved,
+    # or is a hard link to content we have already hashed
+    row = conn.execute(
+        "SELECT path, sha256 FROM files WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+        (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+    ).fetchone()
+    if row is None:
+        return None
+    if os.path.exists(row[0]):
+        record(file_path, st, row[1])
+    else:
+        with conn:
+            conn.execute("DELETE FROM files WHERE path = ?", (file_path,))
+            conn.execute("UPDATE files SET path = ? WHERE path = ?", (file_path, row[0]))
+    return row[1]
+
+def record(file_path, st, sha256):
+    """Store a file's SHA256 in the index."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, device, inode, sha256, autov2)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (file_path, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino, sha256, autov2_hash(sha256)),
+        )
+
+def record_moves(moves):
+    """Point indexed files at their new locations after a batch of (old, new) moves."""
+    conn = get_connection()
+    with conn:
+        for old_path, new_path in moves:
+            conn.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(new_path),))
+            conn.execute("UPDATE files SET path = ? WHERE path = ?",
+                         (os.path.abspath(new_path), os.path.abspath(old_path)))
+
+def paths_for_hash(sha256):
+    """Return indexed paths whose file still has this SHA256 (size, mtime and inode unchanged)."""
+    rows = get_connection().execute(
+        "SELECT path, size, mtime_ns, device, inode FROM files WHERE sha256 = ?", (sha256.lower(),)
+    ).fetchall()
+    paths = []
+    for path, size, mtime_ns, device, inode in rows:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if (st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino) == (size, mtime_ns, device, inode):
+            paths.append(path)
+    return paths
+
+def get_file_hash(file_path):
+    """Return a file's SHA256, reading it only if the index has no match."""
+    file_path = os.path.abspath(file_path)
+    st = os.stat(file_path)
+    sha256 = lookup(file_path, st)
+    if sha256 is None:
+        sha256 = hash_file(file_path)
+        record(file_path, st, sha256)
+    return sha256
+
+def find_model_files(folder_path, extensions=MODEL_EXTENSIONS):
+    """Return the paths of all model files under folder_path."""
+    return [
+        os.path.join(root, file)
+        for root, dirs, files in os.walk(folder_path)
+        for file in files
+        if file.endswith(extensions)
+    ]
+
+def hash_files(paths, workers=None):
+    """Hash many files concurrently; returns {path: sha256} for the given paths.
+
+    Files that cannot be read are left out of the result.
+    """
+    def safe_hash(path):
+        try:
+            return get_file_hash(path)
+        except OSError as e:
+            print(f"Error hashing {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or HASH_WORKERS) as executor:
+        results = executor.map(safe_hash, paths)
+        return {path: sha256 for path, sha256 in zip(paths, results) if sha256}
+
+def prune():
+    """Drop index rows for files that no longer exist; returns the count removed."""
+    conn = get_connection()
+    missing = [path for (path,) in conn.execute("SELECT path FROM files") if not os.path.exists(path)]
+    with conn:
+        conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in missing])
+    return len(missing)
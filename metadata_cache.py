@@ -0,0 +1,226 @@
+"""Persistent on-disk cache for Civitai API responses.
+
+Responses from /model-versions/{id}, /models/{id} and
+/model-versions/by-hash/{hash} are stored in a small SQLite database keyed
+by endpoint path, so repeated runs of the extractor, rename and hash
+scripts do not fetch the same metadata again. Entries expire after a
+per-endpoint TTL, and the least recently used entries are evicted once the
+cache grows past MAX_BYTES. Not-found answers are cached too, for a
+shorter time.
+
+get_versions_by_hash() identifies many files at once: cached hashes are
+answered locally and the rest go to the batch by-hash endpoint in chunks
+(or, if the API rejects it, to concurrent single lookups). Every chunk is
+cached as soon as it arrives, so an interrupted scan resumes where it
+stopped.
+
+Set CIVITAI_OFFLINE=1 (or OFFLINE = True) to answer only from the cache.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import civitai_client
+import metrics
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.path.join(SCRIPT_DIR, "civitai_cache.sqlite")
+API_BASE = "https://civitai.com/api/v1"
+
+# Time-to-live in seconds for each kind of response
+VERSION_TTL = 30 * 86400   # model versions rarely change once published
+MODEL_TTL = 86400          # models gain new versions over time
+HASH_TTL = 30 * 86400
+NEGATIVE_TTL = 86400       # how long a 404 is remembered
+MAX_BYTES = 256 * 1024 * 1024
+LOW_WATER_BYTES = MAX_BYTES * 9 // 10  # eviction frees space down to this
+
+HASH_BATCH_SIZE = 100     # hashes per batch by-hash request
+LOOKUP_WORKERS = 8        # concurrent single lookups when batching is unavailable
+
+OFFLINE = os.environ.get("CIVITAI_OFFLINE") == "1"
+
+_local = threading.local()
+_batch_by_hash = True  # cleared once the API rejects the batch endpoint
+
+def get_connection():
+    """Return this thread's connection to the cache database."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Seed the total and add its triggers before any other connection can store
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " body TEXT,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        # Running total of entries.size, kept up to date by triggers
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO stats (name, value)"
+                     " SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM entries")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN"
+                     " UPDATE stats SET value = value + NEW.size WHERE name = 'total_bytes'; END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN"
+                     " UPDATE stats SET value = value - OLD.size WHERE name = 'total_bytes'; END")
+        conn.execute("CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries BEGIN"
+                     " UPDATE stats SET value = value + NEW.size - OLD.size WHERE name = 'total_bytes'; END")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+def lookup(key):
+    """Return (found, data) for a cached key; expired entries count as missing unless offline."""
+    conn = get_connection()
+    row = conn.execute("SELECT body, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+    if row is None or (row[1] < time.time() and not OFFLINE):
+        return False, None
+    with conn:
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+    return True, json.loads(row[0]) if row[0] is not None else None
+
+def store(key, data, ttl):
+    """Cache data (None for not found) under key, evicting once over MAX_BYTES."""
+    body = json.dumps(data, separators=(",", ":")) if data is not None else None
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the triggers
+        conn.execute(
+            "INSERT INTO entries (key, body, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET body = excluded.body, size = excluded.size,"
+            " expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+            (key, body, len(body or ""), now + ttl, now),
+        )
+        total = conn.execute("SELECT value FROM stats WHERE name = 'total_bytes'").fetchone()[0]
+        if total > MAX_BYTES:
+            evict(conn, total - LOW_WATER_BYTES)
+
+def evict(conn, excess):
+    """Drop the least recently used entries until excess bytes are freed."""
+    keys = []
+    for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+        if excess <= 0:
+            break
+        keys.append((key,))
+        excess -= size
+    conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+def fetch_json(path, ttl):
+    """Return the JSON body for an API path, from cache when possible.
+
+    Returns None when the API answers 404 or when offline with no cached
+    copy; other HTTP errors are raised as requests.HTTPError.
+    """
+    found, data = lookup(path)
+    if found or OFFLINE:
+        metrics.inc("civitai_cache_total", result="hit" if found else "offline")
+        return data
+    metrics.inc("civitai_cache_total", result="miss")
+    response = civitai_client.get(f"{API_BASE}{path}")
+    if response.status_code == 404:
+        store(path, None, NEGATIVE_TTL)
+        return None
+    response.raise_for_status()
+    data = response.json()
+    store(path, data, ttl)
+    return data
+
+def get_model_version(version_id):
+    """Return /model-versions/{version_id} metadata, or None if unknown."""
+    return fetch_json(f"/model-versions/{version_id}", VERSION_TTL)
+
+def get_model(model_id):
+    """Return /models/{model_id} metadata, or None if unknown."""
+    return fetch_json(f"/models/{model_id}", MODEL_TTL)
+
+def hash_key(file_hash):
+    """Return the cache key (API path) for a by-hash lookup."""
+    return f"/model-versions/by-hash/{file_hash.lower()}"
+
+def get_version_by_hash(file_hash):
+    """Return the model version whose file has this hash, or None if unknown."""
+    data = fetch_json(hash_key(file_hash), HASH_TTL)
+    if data and "id" in data:
+        # The same payload answers a later lookup by version ID
+        store(f"/model-versions/{data['id']}", data, VERSION_TTL)
+    return data
+
+def fetch_hash_batch(file_hashes):
+    """Resolve up to HASH_BATCH_SIZE hashes with one POST, caching every answer.
+
+    Returns {hash: version or None}, or None if the batch request failed.
+    """
+    global _batch_by_hash
+    try:
+        response = civitai_client.request("POST", f"{API_BASE}/model-versions/by-hash", json=file_hashes)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code in (400, 404, 405):
+        _batch_by_hash = False
+        return None
+    if response.status_code != 200:
+        return None
+    try:
+        versions = response.json()
+    except ValueError:
+        return None
+    results = dict.fromkeys(file_hashes)
+    for version in versions:
+        for file in version.get("files", []):
+            sha256 = (file.get("hashes") or {}).get("SHA256", "").lower()
+            if sha256 in results:
+                results[sha256] = version
+    for file_hash, data in results.items():
+        store(hash_key(file_hash), data, HASH_TTL if data else NEGATIVE_TTL)
+        if data and "id" in data:
+            store(f"/model-versions/{data['id']}", data, VERSION_TTL)
+    return results
+
+def get_versions_by_hash(file_hashes, workers=LOOKUP_WORKERS):
+    """Return {hash: version or None} for many file hashes, keyed by lowercase hash.
+
+    Duplicate hashes are looked up once. Hashes whose lookup failed with
+    a network or HTTP error or an unreadable answer, or that are not cached
+    while offline, are left out of the result.
+    """
+    results = {}
+    missing = []
+    for file_hash in dict.fromkeys(file_hash.lower() for file_hash in file_hashes):
+        found, data = lookup(hash_key(file_hash))
+        if found:
+            metrics.inc("civitai_cache_total", result="hit")
+            results[file_hash] = data
+        elif OFFLINE:
+            # Unknown rather than not found, so it is left out like a failed lookup
+            metrics.inc("civitai_cache_total", result="offline")
+        else:
+            metrics.inc("civitai_cache_total", result="miss")
+            missing.append(file_hash)
+
+    def single_lookup(file_hash):
+        try:
+            return file_hash, get_version_by_hash(file_hash)
+        except (requests.exceptions.RequestException, ValueError):
+            return file_hash, False
+
+    for start in range(0, len(missing), HASH_BATCH_SIZE):
+        chunk = missing[start:start + HASH_BATCH_SIZE]
+        batch = fetch_hash_batch(chunk) if _batch_by_hash else None
+        if batch is None:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                batch = {file_hash: data for file_hash, data in executor.map(single_lookup, chunk)
+                         if data is not False}
+        results.update(batch)
+    return results
@@ -0,0 +1,210 @@
+"""Run metrics and structured events for the downloader and API calls.
+
+Counters and histograms are kept in memory for every run and summarised
+by report() at the end, e.g. per-file throughput, API latency
+percentiles, retries and time spent writing to disk. That is enough to
+tell whether a slow night was bandwidth, API latency or the disk.
+
+Set CIVITAI_METRICS_DIR (or METRICS_DIR) to also write:
+
+    events.jsonl   one JSON object per event (API call, download, lookup)
+    metrics.prom   Prometheus text format, rewritten every FLUSH_INTERVAL
+                   seconds and at the end of a run; point node_exporter's
+                   textfile collector at the folder to scrape it
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+METRICS_DIR = os.environ.get("CIVITAI_METRICS_DIR") or None
+FLUSH_INTERVAL = 15.0   # seconds between metrics.prom rewrites
+MAX_SAMPLES = 10000     # observations kept per histogram for percentiles
+
+# Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+BYTES_PER_SECOND_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-4, 11))  # 64 KiB/s .. 1 GiB/s
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()  # one metrics.prom writer at a time
+_counters = {}
+_gauges = {}
+_histograms = {}
+_events_file = None
+_last_flush = 0.0
+_write_failed = False
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps recent samples for percentiles."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.samples = []
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        if len(self.samples) >= MAX_SAMPLES:
+            self.samples[self.count % MAX_SAMPLES] = value
+        else:
+            self.samples.append(value)
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to value."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, buckets=SECONDS_BUCKETS, **labels):
+    """Record one observation in a histogram."""
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = Histogram(buckets)
+        _histograms[key].observe(value)
+
+def event(kind, **fields):
+    """Write a structured event to events.jsonl (when METRICS_DIR is set)."""
+    if not METRICS_DIR:
+        return
+    global _events_file, _write_failed
+    line = json.dumps({"ts": round(time.time(), 3), "event": kind, **fields}, separators=(",", ":"))
+    # Events are written from the request path, so a full disk must not fail the request
+    try:
+        with _lock:
+            if _events_file is None:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                _events_file = open(os.path.join(METRICS_DIR, "events.jsonl"), "a", encoding="utf-8")
+            _events_file.write(line + "\n")
+            _events_file.flush()
+        if time.monotonic() - _last_flush >= FLUSH_INTERVAL and _flush_lock.acquire(blocking=False):
+            try:
+                # Another thread may have flushed since the check above
+                if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+                    _write_prom()
+            finally:
+                _flush_lock.release()
+    except OSError as e:
+        if not _write_failed:
+            _write_failed = True
+            print(f"Error writing metrics to {METRICS_DIR}: {e}")
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in pairs) + "}"
+
+def prometheus_text():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for kind, store in (("counter", _counters), ("gauge", _gauges)):
+            for name in sorted({name for name, _ in store}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(store.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in _histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), hist in sorted(_histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+    return "\n".join(lines) + "\n"
+
+def flush():
+    """Rewrite metrics.prom atomically (when METRICS_DIR is set)."""
+    with _flush_lock:
+        _write_prom()
+
+def _write_prom():
+    """Rewrite metrics.prom; the caller holds _flush_lock."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, "metrics.prom")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(path + ".tmp", path)
+
+def counter_total(name, **labels):
+    """Return the sum of a counter over all label sets matching labels."""
+    with _lock:
+        return sum(value for (metric, key), value in _counters.items()
+                   if metric == name and set(labels.items()) <= set(key))
+
+def histogram(name, **labels):
+    """Return the histogram for name and labels, or None."""
+    with _lock:
+        return _histograms.get(_key(name, labels))
+
+def format_rate(bytes_per_second):
+    """Return a byte rate as MiB/s."""
+    return f"{bytes_per_second / (1024 * 1024):.1f} MiB/s"
+
+def summary():
+    """Return a short human-readable report of this run's metrics."""
+    lines = []
+    downloads = counter_total("downloads_total")
+    if downloads:
+        outcomes = ", ".join(f"{outcome} {int(counter_total('downloads_total', outcome=outcome))}"
+                             for outcome in ("done", "reused", "failed", "deferred")
+                             if counter_total("downloads_total", outcome=outcome))
+        lines.append(f"Downloads: {int(downloads)} ({outcomes})")
+        received = counter_total("download_bytes_total")
+        seconds = histogram("download_seconds")
+        throughput = histogram("download_throughput_bytes_per_second")
+        if seconds and seconds.count:
+            lines.append(f"  {received / (1024 ** 3):.2f} GiB in {seconds.total:.0f} s of transfer time")
+        if throughput and throughput.count:
+            lines.append(f"  per-file throughput p50 {format_rate(throughput.percentile(0.5))}, "
+                         f"p5 {format_rate(throughput.percentile(0.05))}")
+        write_time = counter_total("download_write_seconds_total")
+        if seconds and seconds.total:
+            lines.append(f"  disk writes {write_time:.1f} s ({100 * write_time / seconds.total:.0f}% of transfer time)")
+    for endpoint in ("metadata", "download"):
+        latency = histogram("civitai_request_seconds", endpoint=endpoint)
+        if latency and latency.count:
+            retries = int(counter_total("civitai_retries_total", endpoint=endpoint))
+            throttled = int(counter_total("civitai_responses_total", endpoint=endpoint, status="429"))
+            lines.append(f"API {endpoint}: {latency.count} requests, latency p50 {latency.percentile(0.5):.2f} s, "
+                         f"p95 {latency.percentile(0.95):.2f} s, {retries} retries, {throttled} throttled")
+    hits = counter_total("civitai_cache_total", result="hit")
+    misses = counter_total("civitai_cache_total", result="miss")
+    if hits or misses:
+        lines.append(f"Metadata cache: {int(hits)} hits, {int(misses)} misses")
+    return "\n".join(lines)
+
+def report():
+    """Print the run summary and write the metrics files."""
+    text = summary()
+    if text:
+        print(f"\n{text}")
+    flush()
@@ -0,0 +1,184 @@
+"""Sort model files into <type>/<base model>/ folders named after the model.
+
+One engine for every model type, replacing the separate checkpoint and
+LoRA rename passes. The destination comes from two routing tables:
+TYPE_FOLDERS (API model.type -> library folder) and BASE_MODEL_FOLDERS
+(baseModel substring -> subfolder). A single walk of a folder hashes all
+model files on the hashing pool, identifies them from the download ledger
+or the by-hash API, and builds a move plan. The plan can be printed as a
+dry run, or applied in one batch.
+
+    python model_sorter.py D:/incoming --dry-run
+    python model_sorter.py D:/incoming --unknown-type LORA
+"""
+import argparse
+import os
+import re
+import shutil
+
+import download_ledger
+import file_hashing
+import metadata_cache
+import metrics
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (substring of the lowercased baseModel, folder name), first match wins
+BASE_MODEL_FOLDERS = [
+    ("sd 1.5", "sd.15"),
+    ("flux", "flux"),
+    ("pony", "pony"),
+    ("sdxl", "sdxl"),
+    ("illustrious", "illustrious"),
+]
+UNKNOWN_FOLDER = "none"
+
+# API model.type -> top-level library folder
+TYPE_FOLDERS = {"Checkpoint": "checkpoints", "LORA": "loras"}
+OTHER_TYPES_FOLDER = "others"
+
+def clean_filename(name):
+    """Clean filename of invalid characters but keep spaces"""
+    invalid_chars = '<>:"/\\|?*'
+    for char in invalid_chars:
+        name = name.replace(char, '')
+    return name.strip()
+
+def base_model_folder(base_model):
+    """Return the folder for a baseModel; unknown base models get their own folder."""
+    if not base_model:
+        return UNKNOWN_FOLDER
+    base_model = base_model.lower()
+    for needle, folder in BASE_MODEL_FOLDERS:
+        if needle in base_model:
+            return folder
+    return clean_filename(base_model) or UNKNOWN_FOLDER
+
+def type_folder(model_type):
+    """Return the top-level library folder for an API model type."""
+    return TYPE_FOLDERS.get(model_type, OTHER_TYPES_FOLDER)
+
+def unique_path(directory, filename):
+    """Return a path in directory that does not exist yet, adding (n) if needed."""
+    base, ext = os.path.splitext(filename)
+    candidate = filename
+    counter = 1
+    while os.path.exists(os.path.join(directory, candidate)):
+        candidate = f"{base}({counter}){ext}"
+        counter += 1
+    return os.path.join(directory, candidate)
+
+def target_folder(data, base_dir=None):
+    """Return the folder a model version's file belongs in, under base_dir (default: script directory)."""
+    model = data.get("model", {})
+    return os.path.join(base_dir or SCRIPT_DIR, type_folder(model.get("type")), base_model_folder(data.get("baseModel")))
+
+def lookup_metadata_many(hashes):
+    """Return {sha256: metadata or None} for many hashes, ledger first, then the batched API lookup.
+
+    Hashes whose API lookup failed are left out.
+    """
+    results = {}
+    remaining = []
+    for sha256 in dict.fromkeys(sha256.lower() for sha256 in hashes):
+        data = download_ledger.metadata_for_hash(sha256)
+        if data:
+            results[sha256] = data
+        else:
+            remaining.append(sha256)
+    found = metadata_cache.get_versions_by_hash(remaining)
+    results.update(found)
+    metrics.inc("hash_lookups_total", len(results) - len(found), source="ledger")
+    metrics.inc("hash_lookups_total", sum(1 for data in found.values() if data), source="api")
+    metrics.inc("hash_lookups_total", sum(1 for data in found.values() if not data), source="not_found")
+    metrics.inc("hash_lookups_total", len(remaining) - len(found), source="error")
+    metrics.event("identify", hashes=len(remaining) + len(results) - len(found), ledger=len(results) - len(found),
+                  api=len(found), failed=len(remaining) - len(found))
+    return results
+
+def already_in_place(file_path, folder, filename):
+    """True if file_path is folder/filename or a numbered copy of it, e.g. name(1).ext."""
+    if os.path.normcase(os.path.dirname(os.path.abspath(file_path))) != os.path.normcase(os.path.abspath(folder)):
+        return False
+    base, ext = os.path.splitext(filename)
+    return re.fullmatch(re.escape(base) + r"(\(\d+\))?" + re.escape(ext), os.path.basename(file_path)) is not None
+
+def plan_moves(folder_path, unknown_type=None, library_root=None):
+    """Walk folder_path once and return the moves needed to sort it.
+
+    Returns a list of (source path, target folder, target filename, metadata)
+    tuples; files already in place are left out. Files Civitai does not
+    know go to <unknown_type's folder>/none/ under their current name.
+    Files whose lookup failed stay where they are until a later run.
+    """
+    paths = file_hashing.find_model_files(folder_path)
+    hashes = file_hashing.hash_files(paths)
+    paths = [path for path in paths if path in hashes]
+    found = lookup_metadata_many(hashes.values())
+    unidentified = [path for path in paths if hashes[path] not in found]
+    if unidentified:
+        print(f"Could not look up {len(unidentified)} files; leaving them in place")
+        paths = [path for path in paths if hashes[path] in found]
+
+    plan = []
+    for path in paths:
+        data = found.get(hashes[path])
+        stem, ext = os.path.splitext(os.path.basename(path))
+        if data:
+            folder = target_folder(data, library_root)
+            filename = f"{clean_filename(data.get('model', {}).get('name') or '') or stem}{ext}"
+        else:
+            folder = os.path.join(library_root or SCRIPT_DIR, type_folder(unknown_type), UNKNOWN_FOLDER)
+            filename = os.path.basename(path)
+        if not already_in_place(path, folder, filename):
+            plan.append((path, folder, filename, data))
+    return plan
+
+def apply_plan(plan):
+    """Carry out a move plan; returns the list of (old path, new path) moved.
+
+    The hash index and ledger are updated once for the whole batch.
+    """
+    moves = []
+    created = set()
+    for path, folder, filename, data in plan:
+        try:
+            if folder not in created:
+                os.makedirs(folder, exist_ok=True)
+                created.add(folder)
+            new_path = unique_path(folder, filename)
+            shutil.move(path, new_path)
+            moves.append((path, new_path, data))
+        except OSError as e:
+            print(f"Error moving {path}: {e}")
+    file_hashing.record_moves([(old, new) for old, new, _ in moves])
+    download_ledger.update_file_paths([(data["id"], os.path.abspath(new)) for _, new, data in moves
+                                       if data and "id" in data])
+    return [(old, new) for old, new, _ in moves]
+
+def sort_library(folder_path, unknown_type=None, dry_run=False, library_root=None):
+    """Sort every model file under folder_path in one pass; returns the plan."""
+    plan = plan_moves(folder_path, unknown_type, library_root)
+    root = library_root or SCRIPT_DIR
+    for path, folder, filename, data in plan:
+        label = "" if data else "  (not found on Civitai)"
+        print(f"{path} -> {os.path.relpath(os.path.join(folder, filename), root)}{label}")
+    if dry_run:
+        print(f"\nDry run: {len(plan)} files would be moved")
+    else:
+        moved = apply_plan(plan)
+        print(f"\nMoved {len(moved)} of {len(plan)} files")
+    return plan
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", help="folder to scan for model files")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without moving anything")
+    parser.add_argument("--unknown-type", default=None,
+                        help="model type whose folder receives unidentified files (e.g. LORA, Checkpoint)")
+    parser.add_argument("--library-root", default=None, help="library root (default: script directory)")
+    args = parser.parse_args()
+    sort_library(args.folder, args.unknown_type, args.dry_run, args.library_root)
+
+if __name__ == "__main__":
+    main()
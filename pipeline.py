@@ -0,0 +1,176 @@
+"""Non-interactive extract -> download -> hash -> sort pipeline.
+
+Runs the three manual steps (1_Civitai_link_extractor.py, the
+2_civitai_downloader.py menu and the rename scripts) as one process.
+Stages are connected by bounded queues, so they overlap: links are
+resolved in batches while earlier batches download, each file is hashed
+as its bytes arrive, and download_file names and places a finished file
+in <type>/<base model>/ from the metadata the resolver stored, so there
+is no separate sort pass.
+
+    python pipeline.py                  # process urls.txt
+    python pipeline.py --workers 8 --input my_links.txt
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import queue
+import threading
+
+import download_ledger
+import download_queue
+import metrics
+import model_sorter
+
+extractor = importlib.import_module("1_Civitai_link_extractor")
+downloader = importlib.import_module("2_civitai_downloader")
+
+RESOLVE_BATCH = 50   # links resolved per extractor pass
+QUEUE_SIZE = 32      # resolved entries buffered ahead of the download workers
+STOP_POLL = 0.5      # seconds between stop checks while a stage waits on the queue
+
+_DONE = object()
+
+def read_urls(input_file):
+    """Return the non-empty lines of input_file, or [] if it does not exist."""
+    if not os.path.exists(input_file):
+        return []
+    with open(input_file, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def put(download_q, item, stop):
+    """Put item on the bounded queue unless stop is set first; returns True if it was put."""
+    while not stop.is_set():
+        try:
+            download_q.put(item, timeout=STOP_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def resolve_stage(urls, download_q, progress, stats, workers, stop):
+    """Resolve links in batches and feed new versions to the download stage.
+
+    stats["next"] is the index of the first link not fully handled yet.
+    It only moves past a batch once the batch is queued, so links in a
+    batch that raised, or that were never reached before stop was set,
+    are written back to the input file.
+    """
+    queued_versions = set()
+    try:
+        for start in range(0, len(urls), RESOLVE_BATCH):
+            if stop.is_set():
+                return
+            batch = urls[start:start + RESOLVE_BATCH]
+            entries = []
+            unresolved = []
+            for url, result in zip(batch, asyncio.run(extractor.resolve_urls(batch))):
+                if result is None:
+                    unresolved.append(url)
+                elif result != "skipped" and result["version_id"] not in queued_versions:
+                    queued_versions.add(result["version_id"])
+                    entries.append(result)
+            # Record the batch before downloading so a crash leaves it in the download queue
+            download_ledger.record_queued_many(entries)
+            for entry in entries:
+                entry["category"] = model_sorter.type_folder(entry["model_type"])
+                download_queue.add_urls(entry["category"], [entry["download_url"]])
+            stats["unresolved"].extend(unresolved)
+            stats["next"] = start + len(batch)
+            progress.add_files(len(entries))
+            for entry in entries:
+                if not put(download_q, entry, stop):
+                    return  # the rest stay pending in the download queue
+    except Exception as e:
+        print(f"\nResolving stopped at link {stats['next'] + 1}: {e}")
+    finally:
+        for _ in range(workers):
+            put(download_q, _DONE, stop)
+
+def download_stage(download_q, progress, stop):
+    """Download, hash and place queued versions until the resolver is done or stop is set."""
+    while not stop.is_set():
+        try:
+            entry = download_q.get(timeout=STOP_POLL)
+        except queue.Empty:
+            continue
+        if entry is _DONE:
+            return
+        category, url = entry["category"], entry["download_url"]
+        config = downloader.MODEL_TYPES[category]
+        os.makedirs(config["folder"], exist_ok=True)
+        download_queue.mark(category, url, download_queue.IN_PROGRESS)
+        try:
+            file_path = downloader.download_file(url, config["folder"], category, progress)
+        except downloader.InsufficientSpace:
+            # Stays queued for the downloader once there is room
+            download_queue.mark(category, url, download_queue.PENDING)
+            progress.file_deferred()
+            continue
+        download_queue.mark(category, url, download_queue.DONE if file_path else download_queue.FAILED)
+        progress.file_finished(file_path is not None)
+
+def write_remaining(input_file, urls, stats):
+    """Write unresolved links and links the resolver never finished back to input_file."""
+    with open(input_file, "w") as f:
+        f.writelines(f"{url}\n" for url in stats["unresolved"] + urls[stats["next"]:])
+
+def run_pipeline(input_file=extractor.INPUT_FILE, workers=downloader.MAX_WORKERS):
+    """Resolve, download, hash and place every link in input_file.
+
+    Links that could not be resolved, or were not reached, are written
+    back to input_file. On Ctrl+C both stages stop taking new work; an
+    interrupted transfer resumes from its .part file and anything still
+    queued stays pending for the downloader. Returns a dict of counts.
+    """
+    urls = read_urls(input_file)
+    if not urls:
+        print(f"No links in {input_file}")
+        return {}
+
+    downloader.set_workers(workers)
+    download_q = queue.Queue(maxsize=QUEUE_SIZE)
+    progress = downloader.DownloadProgress(0)
+    stats = {"unresolved": [], "next": 0}
+    stop = threading.Event()
+
+    # Daemon threads, so an interrupted run exits without waiting for a transfer to finish
+    resolver = threading.Thread(target=resolve_stage, args=(urls, download_q, progress, stats, workers, stop),
+                                daemon=True)
+    download_threads = [threading.Thread(target=download_stage, args=(download_q, progress, stop), daemon=True)
+                        for _ in range(max(1, workers))]
+    for thread in [resolver, *download_threads]:
+        thread.start()
+    try:
+        resolver.join()
+        for thread in download_threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        write_remaining(input_file, urls, stats)
+        raise
+    finally:
+        progress.close()
+
+    write_remaining(input_file, urls, stats)
+    remaining = len(urls) - stats["next"]
+    summary = {"links": len(urls), "unresolved": len(stats["unresolved"]) + remaining,
+               "downloaded": progress.done, "failed": progress.failed, "deferred": progress.deferred}
+    print(f"\nPipeline complete: {summary}")
+    downloader.queue_gauges()
+    metrics.report()
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=extractor.INPUT_FILE, help="file with one Civitai link per line")
+    parser.add_argument("--workers", type=int, default=downloader.MAX_WORKERS, help="parallel downloads")
+    args = parser.parse_args()
+    try:
+        run_pipeline(args.input, args.workers)
+    except KeyboardInterrupt:
+        print("\nInterrupted; unfinished links are back in the input file")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Watch tracked models for new versions and queue them for download.
+
+A model link is resolved once, to the version that was newest at the
+time, and the model is then known to the ledger, so its later releases
+were never picked up. Every model in the ledger is watched (--remove
+stops that), and a check asks the API about all of them:
+
+- in batches of BATCH_SIZE IDs per /models?ids=... request, sending the
+  batch's last ETag as If-None-Match, so an unchanged batch is a 304
+- models a batch answer leaves out (hidden, deleted, or the API refused
+  the bulk query) are asked one by one with If-None-Match/If-Modified-Since
+
+Each model's version list is kept in the ledger and diffed with the new
+one, and only versions that are in neither that list nor the ledger are
+queued. The first check of a model just records its list, except for
+versions newer than the newest one already in the ledger. A thousand
+models cost about ten requests per check, so it can run every hour.
+
+    python watch.py                     # check once
+    python watch.py --interval 3600     # check every hour
+    python watch.py --interval 3600 --download
+    python watch.py --add 1234 --remove 5678
+"""
+import argparse
+import hashlib
+import importlib
+import time
+
+import requests
+
+import civitai_client
+import download_ledger
+import download_queue
+import metadata_cache
+import metrics
+import model_sorter
+
+extractor = importlib.import_module("1_Civitai_link_extractor")
+
+BATCH_SIZE = 100         # model IDs per /models?ids=... request
+DEFAULT_INTERVAL = 3600  # seconds between checks with --interval and no value
+
+_bulk_query = True  # cleared once the API rejects /models?ids=...
+_NOT_MODIFIED = object()  # fetch_batch's answer to a 304
+
+def conditional_headers(etag=None, last_modified=None):
+    """Return If-None-Match/If-Modified-Since headers for a stored answer."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+def batch_key(model_ids):
+    """Return the ledger meta key holding the ETag of a batch of model IDs."""
+    return "watch_etag:" + hashlib.sha1(",".join(map(str, model_ids)).encode()).hexdigest()
+
+def fetch_batch(model_ids):
+    """Ask for many models in one request.
+
+    Returns (models, etag): models is {model_id: model} for the models in
+    the answer (models it leaves out are asked one by one), _NOT_MODIFIED
+    when the batch is unchanged since the last check, or None when the
+    request failed and every model has to be asked one by one. etag is
+    only returned when the answer covered the whole batch.
+    """
+    global _bulk_query
+    params = [("ids", model_id) for model_id in model_ids] + [("limit", len(model_ids))]
+    try:
+        response = civitai_client.get(f"{metadata_cache.API_BASE}/models", params=params,
+                                      headers=conditional_headers(download_ledger.get_meta(batch_key(model_ids))))
+    except requests.exceptions.RequestException:
+        return None, None
+    if response.status_code == 304:
+        return _NOT_MODIFIED, None
+    if response.status_code in (400, 404, 405):
+        _bulk_query = False
+        return None, None
+    if response.status_code != 200:
+        return None, None
+    try:
+        items = response.json().get("items", [])
+    except ValueError:
+        return None, None
+    models = {item["id"]: item for item in items if item.get("id") in model_ids}
+    return models, response.headers.get("ETag") if len(models) == len(model_ids) else None
+
+def fetch_model(watched):
+    """Ask for one model with a conditional request.
+
+    Returns (status, model, response headers); status is "unchanged",
+    "fetched", "missing" or "error".
+    """
+    model_id = watched["model_id"]
+    try:
+        response = civitai_client.get(f"{metadata_cache.API_BASE}/models/{model_id}",
+                                      headers=conditional_headers(watched["etag"], watched["last_modified"]))
+    except requests.exceptions.RequestException as e:
+        print(f"Error checking model {model_id}: {e}")
+        return "error", None, {}
+    if response.status_code == 304:
+        return "unchanged", None, {}
+    if response.status_code == 404:
+        return "missing", None, {}
+    if response.status_code != 200:
+        print(f"Error checking model {model_id}: HTTP {response.status_code}")
+        return "error", None, {}
+    try:
+        return "fetched", response.json(), response.headers
+    except ValueError as e:
+        print(f"Error checking model {model_id}: {e}")
+        return "error", None, {}
+
+def new_versions(watched, model):
+    """Return the version IDs of model that should be queued."""
+    current = [version["id"] for version in model.get("modelVersions", []) if version.get("id")]
+    have = download_ledger.version_ids_for_model(watched["model_id"])
+    if watched["version_ids"] is None:
+        # First check: only what was released after the newest version we have
+        newest = max(have, default=None)
+        return [v for v in current if newest is not None and v > newest]
+    seen = set(watched["version_ids"])
+    return [v for v in current if v not in seen and v not in have]
+
+def version_entries(watched, model):
+    """Return queue entries for the new versions of a fetched model."""
+    model_id = watched["model_id"]
+    entries = []
+    for version_id in new_versions(watched, model):
+        source_url = f"https://civitai.com/models/{model_id}?modelVersionId={version_id}"
+        entries.append(extractor.version_entry(source_url, model_id, version_id, model.get("type", "unknown"),
+                                               extractor.version_from_model(model, model_id, version_id)))
+        print(f"New version of {model.get('name', model_id)}: {version_id}")
+    return entries
+
+def queue_versions(entries):
+    """Record new versions in the ledger and add them to the download queue."""
+    download_ledger.record_queued_many(entries)
+    for entry in entries:
+        download_queue.add_urls(model_sorter.type_folder(entry["model_type"]), [entry["download_url"]])
+
+def check_batch(batch, counts):
+    """Check one batch of watched models and queue their new versions."""
+    model_ids = [watched["model_id"] for watched in batch]
+    models, batch_etag = fetch_batch(model_ids) if _bulk_query else (None, None)
+    if models is _NOT_MODIFIED:
+        counts["unchanged"] += len(batch)
+        download_ledger.record_checks((model_id,) for model_id in model_ids)
+        return
+
+    entries = []
+    checks = []  # record_checks rows, applied once the entries are queued
+    for watched in batch:
+        model_id = watched["model_id"]
+        if models is not None and model_id in models:
+            status, model, headers = "fetched", models[model_id], {}
+        else:
+            status, model, headers = fetch_model(watched)
+        counts[status] += 1
+        if status == "fetched":
+            metadata_cache.store(f"/models/{model_id}", model, metadata_cache.MODEL_TTL)
+            entries.extend(version_entries(watched, model))
+            checks.append((model_id, [version["id"] for version in model.get("modelVersions", [])],
+                           headers.get("ETag"), headers.get("Last-Modified")))
+        elif status != "error":
+            checks.append((model_id,))
+
+    # Queue before remembering what was seen, so a crash in between only repeats work
+    queue_versions(entries)
+    counts["queued"] += len(entries)
+    download_ledger.record_checks(checks)
+    if batch_etag:
+        download_ledger.set_meta(batch_key(model_ids), batch_etag)
+
+def check(model_ids=None):
+    """Check watched models (or just model_ids) once and queue their new versions.
+
+    Returns a dict of counts.
+    """
+    watched = [model for model in download_ledger.watched_models()
+               if model_ids is None or model["model_id"] in model_ids]
+    counts = dict.fromkeys(("models", "unchanged", "fetched", "missing", "error", "queued"), 0)
+    counts["models"] = len(watched)
+    for start in range(0, len(watched), BATCH_SIZE):
+        check_batch(watched[start:start + BATCH_SIZE], counts)
+    for status in ("unchanged", "fetched", "missing", "error"):
+        metrics.inc("watch_checks_total", counts[status], result=status)
+    metrics.inc("watch_versions_queued_total", counts["queued"])
+    return counts
+
+def watch(interval=None, download=False, jobs=None):
+    """Check now and then every interval seconds (once if interval is None).
+
+    With download, new versions are downloaded after each check. Returns
+    the counts of the last check.
+    """
+    while True:
+        started = time.monotonic()
+        counts = check()
+        print(f"Checked {counts['models']} models: {counts['unchanged']} unchanged, {counts['fetched']} fetched, "
+              f"{counts['missing']} missing, {counts['error']} errors; {counts['queued']} new versions queued")
+        if download and counts["queued"]:
+            downloader = importlib.import_module("2_civitai_downloader")
+            downloader.process_all_downloads(jobs or downloader.MAX_WORKERS)
+        metrics.report()
+        if not interval:
+            return counts
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interval", type=float, nargs="?", const=DEFAULT_INTERVAL, default=None,
+                        help="keep checking every INTERVAL seconds (default: check once)")
+    parser.add_argument("--download", action="store_true", help="download new versions after each check")
+    parser.add_argument("--jobs", type=int, default=None, help="parallel downloads")
+    parser.add_argument("--add", type=int, nargs="+", default=[], metavar="MODEL_ID", help="start watching models")
+    parser.add_argument("--remove", type=int, nargs="+", default=[], metavar="MODEL_ID",
+                        help="stop watching models")
+    args = parser.parse_args()
+    download_ledger.set_watched(args.add, True)
+    download_ledger.set_watched(args.remove, False)
+    try:
+        watch(args.interval, args.download, args.jobs)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()